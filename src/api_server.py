@@ -1,21 +1,48 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, File, Query, Request, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel, Field, field_validator
-from typing import List, Dict, Optional
-import pandas as pd
-import joblib
-import numpy as np
-import shap
-import sqlite3
+from pydantic import BaseModel, Field, ValidationError, field_validator
+from typing import List, Dict, Literal, Optional
+import csv
 import datetime
+import io
+import json
 import os
 import hashlib
 import time
-from collections import defaultdict
+import threading
+import numpy as np
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from inference import FEATURES, FEATURE_RANGES, MODEL_PATH, SCORED_COLUMNS, InferenceEngine, PredictionCache, read_csv_chunks, scored_csv, validate_input, validate_matrix
+from inference.batching import MICROBATCH_WINDOW_MS, MicroBatcher
+from inference.binary_io import (
+    BINARY_MEDIA_TYPES, FAILED_PREDICTION, NPY_MEDIA_TYPE, RAW_MEDIA_TYPE, max_body_size, raw_row_count, read_matrix,
+    write_predictions
+)
+from inference.pool import InferencePool, PoolSaturated
+from ratelimit import create_limiter
+from storage import DB_PATH, SOURCES, Database, HistoryWriter, decode_explanation, insert_statement, prediction_row
+from storage import aggregates
+from storage.partitions import iter_history
+from storage.schema import PREDICTION_COLUMNS
+
+@asynccontextmanager
+async def lifespan(app):
+    """Stop the inference workers, flush queued history and close database connections on shutdown"""
+    yield
+    inference_pool.shutdown()
+    history.close()
+    db.close()
 
 # Initialize FastAPI app
 app = FastAPI(
+    lifespan=lifespan,
     title="Diabetes Prediction API",
     description="Advanced AI-powered diabetes classification API with SHAP explainability",
     version="1.0.0",
@@ -32,38 +59,50 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress responses for clients that send Accept-Encoding: gzip, streamed exports included
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+
 # Security
 security = HTTPBearer()
 
-# Load the trained model
-MODEL_PATH = os.path.join(os.path.dirname(__file__), 'diabetes_model.pkl')
-model = joblib.load(MODEL_PATH)
-
-# Define features
-FEATURES = ['Gender', 'AGE', 'Urea', 'Cr', 'HbA1c', 'Chol', 'TG', 'HDL', 'LDL', 'VLDL', 'BMI']
-
-# Feature validation ranges
-FEATURE_RANGES = {
-    'Gender': (0, 1),
-    'AGE': (18, 100),
-    'Urea': (1.0, 50.0),
-    'Cr': (5, 1000),
-    'HbA1c': (3.0, 15.0),
-    'Chol': (1.0, 10.0),
-    'TG': (0.1, 50.0),
-    'HDL': (0.1, 5.0),
-    'LDL': (0.1, 10.0),
-    'VLDL': (0.1, 50.0),
-    'BMI': (15.0, 50.0)
-}
-
-# SQLite setup
-DB_PATH = os.path.join(os.path.dirname(__file__), 'user_history.db')
-
-# Rate limiting
-RATE_LIMIT = defaultdict(list)
+# Load the trained model and its explainer through the shared inference engine,
+# with repeated inputs served from the prediction cache
+engine = InferenceEngine(MODEL_PATH, cache=PredictionCache())
+
+# Model and SHAP calls run on this pool, never on the event loop
+inference_pool = InferencePool(engine)
+
+# Opt-in micro-batching of concurrent single-row calls (MICROBATCH_WINDOW_MS > 0)
+micro_batcher = MicroBatcher(inference_pool) if MICROBATCH_WINDOW_MS > 0 else None
+single_row_inference = micro_batcher or inference_pool
+
+# SQLite setup: persistent per-thread connections, schema created once here
+db = Database(DB_PATH)
+# History rows are queued and inserted in bulk by a background thread
+history = HistoryWriter(db)
+
+# Rate limiting: sliding-window counters, idle users evicted as new ones arrive;
+# RATE_LIMIT_BACKEND=shared enforces one limit across uvicorn workers
 MAX_REQUESTS = 100  # requests per hour
 RATE_LIMIT_WINDOW = 3600  # 1 hour in seconds
+RATE_LIMIT = create_limiter(MAX_REQUESTS, RATE_LIMIT_WINDOW)
+
+# Users (token hashes, as returned by get_user_id) allowed to export other users' history
+EXPORT_ADMIN_USER_IDS = [u for u in os.getenv('EXPORT_ADMIN_USER_IDS', '').split(',') if u]
+EXPORT_COLUMNS = ['id'] + PREDICTION_COLUMNS
+EXPORT_CHUNK_ROWS = 500  # rows per streamed chunk
+
+# Largest float32 matrix accepted by /batch-predict in a binary format
+BINARY_BATCH_MAX_ROWS = int(os.getenv('BINARY_BATCH_MAX_ROWS', '100000'))
+
+# Rows predicted per model call by the streaming batch endpoint
+BATCH_STREAM_CHUNK_ROWS = int(os.getenv('BATCH_STREAM_CHUNK_ROWS', '1000'))
+
+# Deferred explanations still pending or not yet committed to the history, keyed
+# by request_id, oldest evicted first; committed ones are read from predictions
+EXPLANATIONS = OrderedDict()
+EXPLANATIONS_LOCK = threading.Lock()
+MAX_STORED_EXPLANATIONS = 10000
 
 # Pydantic models
 class PredictionRequest(BaseModel):
@@ -96,9 +135,15 @@ class PredictionResponse(BaseModel):
     prediction: str
     confidence: str
     explanation: Dict[str, float]
+    explanation_status: str = "ready"
     timestamp: str
     request_id: str
 
+class ExplanationResponse(BaseModel):
+    request_id: str
+    status: str
+    explanation: Dict[str, float]
+
 class BatchPredictionResponse(BaseModel):
     results: List[Dict]
     total_processed: int
@@ -114,78 +159,82 @@ class HealthResponse(BaseModel):
     version: str
 
 # Utility functions
-def validate_input(values):
-    """Validate input values against expected ranges"""
-    errors = []
-    for i, (feature, value) in enumerate(zip(FEATURES, values)):
-        min_val, max_val = FEATURE_RANGES[feature]
-        if value < min_val or value > max_val:
-            errors.append(f"{feature}: {value} (should be between {min_val} and {max_val})")
-    return errors
-
-def get_prediction_with_explanation(values):
-    """Get prediction and SHAP explanation"""
-    values_df = pd.DataFrame([values], columns=FEATURES)
-    pred = model.predict(values_df)[0]
-    
-    # SHAP explanation
-    try:
-        explainer = shap.TreeExplainer(model)
-        shap_values = explainer.shap_values(values_df)
-        if isinstance(shap_values, list):
-            class_idx = int(pred)
-            shap_val = shap_values[class_idx][0]
-        else:
-            shap_val = shap_values[0]
-        
-        # Get top 5 features
-        top_idx = np.argsort(np.abs(shap_val))[::-1][:5]
-        explanation = {FEATURES[i]: float(shap_val[i]) for i in top_idx}
-    except:
-        explanation = {}
-    
-    return pred, explanation
-
 def log_prediction(user_id, values, prediction, explanation, request_id):
-    """Log prediction to database"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS api_history (
-            user_id TEXT,
-            timestamp TEXT,
-            request_id TEXT,
-            input TEXT,
-            prediction TEXT,
-            explanation TEXT
-        )
-    ''')
-    
-    c.execute(
-        "INSERT INTO api_history (user_id, timestamp, request_id, input, prediction, explanation) VALUES (?, ?, ?, ?, ?, ?)",
-        (user_id, datetime.datetime.now().isoformat(), request_id, str(values), str(prediction), str(explanation))
+    """Queue a prediction for the history database and return its write sequence number"""
+    return history.log("api", user_id, values, prediction, explanation, request_id=request_id)
+
+def batch_rows_statement(batch_id, user_id, rows, timestamp):
+    """Insert statement for a batch's (values, prediction, explanation) rows"""
+    return (
+        insert_statement("predictions"),
+        [
+            prediction_row("api", user_id, values, prediction, explanation, timestamp=timestamp, batch_id=batch_id)
+            for values, prediction, explanation in rows
+        ]
     )
-    conn.commit()
-    conn.close()
+
+def batch_run_statement(batch_id, user_id, timestamp, explain_mode, total_rows, successful, processing_time):
+    """Insert statement for a batch's batch_runs entry"""
+    return (
+        insert_statement("batch_runs"),
+        [(batch_id, user_id, timestamp, explain_mode, total_rows, successful, total_rows - successful, processing_time)]
+    )
+
+def log_batch(batch_id, user_id, rows, explain_mode, total_rows, processing_time):
+    """Queue a batch's (values, prediction, explanation) rows and its batch_runs entry as one transaction"""
+    timestamp = datetime.datetime.now().isoformat()
+    history.write_group([
+        batch_rows_statement(batch_id, user_id, rows, timestamp),
+        batch_run_statement(batch_id, user_id, timestamp, explain_mode, total_rows, len(rows), processing_time)
+    ])
+
+def log_batch_rows(batch_id, user_id, rows):
+    """Queue one chunk of a streamed batch's rows"""
+    history.write_group([batch_rows_statement(batch_id, user_id, rows, datetime.datetime.now().isoformat())])
+
+def log_batch_run(batch_id, user_id, explain_mode, total_rows, successful, processing_time):
+    """Queue a streamed batch's batch_runs entry once every chunk is done"""
+    timestamp = datetime.datetime.now().isoformat()
+    history.write_group([
+        batch_run_statement(batch_id, user_id, timestamp, explain_mode, total_rows, successful, processing_time)
+    ])
+
+async def record(log, *args, rows=1):
+    """Hand history to the writer, off the event loop only when its rows would have to wait"""
+    if history.may_block(rows):
+        return await run_in_threadpool(log, *args)
+    return log(*args)
+
+def store_explanation(request_id, user_id, status, explanation, seq=None):
+    """Record the state of a deferred explanation; seq is its history write once logged"""
+    with EXPLANATIONS_LOCK:
+        EXPLANATIONS[request_id] = {"user_id": user_id, "status": status, "explanation": explanation, "seq": seq}
+        EXPLANATIONS.move_to_end(request_id)
+        while len(EXPLANATIONS) > MAX_STORED_EXPLANATIONS:
+            EXPLANATIONS.popitem(last=False)
+
+async def compute_deferred_explanation(request_id, user_id, values, explain_mode):
+    """Compute a SHAP explanation after the response has been sent and log the prediction"""
+    try:
+        # The request was already admitted, so wait for a free slot rather than dropping the work
+        prediction, explanation = await single_row_inference.call(
+            "predict_with_explanation", values, mode=explain_mode, wait=True
+        )
+    except Exception:
+        # Reported as failed, or /explanations would answer 202 until the entry is evicted
+        store_explanation(request_id, user_id, "failed", {})
+        return
+    seq = await record(log_prediction, user_id, values, prediction, explanation, request_id)
+    # Kept here until the history write is committed, after which every worker can read it
+    store_explanation(request_id, user_id, "ready" if explanation else "failed", explanation, seq)
 
 def check_rate_limit(user_id: str):
     """Check rate limit for user"""
-    current_time = time.time()
-    user_requests = RATE_LIMIT[user_id]
-    
-    # Remove old requests outside the window
-    user_requests = [req_time for req_time in user_requests if current_time - req_time < RATE_LIMIT_WINDOW]
-    RATE_LIMIT[user_id] = user_requests
-    
-    if len(user_requests) >= MAX_REQUESTS:
+    if not RATE_LIMIT.hit(user_id):
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
             detail=f"Rate limit exceeded. Maximum {MAX_REQUESTS} requests per hour."
         )
-    
-    # Add current request
-    user_requests.append(current_time)
-    RATE_LIMIT[user_id] = user_requests
 
 def get_user_id(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Extract user ID from token"""
@@ -193,6 +242,15 @@ def get_user_id(credentials: HTTPAuthorizationCredentials = Depends(security)):
     # For now, we'll use a simple hash of the token
     return hashlib.md5(credentials.credentials.encode()).hexdigest()
 
+@app.exception_handler(PoolSaturated)
+async def pool_saturated_handler(request, exc: PoolSaturated):
+    """Shed load with 503 and Retry-After when the inference pool is full"""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server is busy, please retry later"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 # API endpoints
 @app.get("/", response_model=Dict[str, str])
 async def root():
@@ -205,17 +263,16 @@ async def root():
     }
 
 @app.get("/health", response_model=HealthResponse)
-async def health_check():
+def health_check():
     """Health check endpoint"""
     start_time = time.time()
     
     # Check model
-    model_loaded = model is not None
+    model_loaded = engine.model is not None
     
     # Check database
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.close()
+        db.query("SELECT 1")
         database_connected = True
     except:
         database_connected = False
@@ -229,7 +286,13 @@ async def health_check():
     )
 
 @app.post("/predict", response_model=PredictionResponse)
-async def predict(request: PredictionRequest, user_id: str = Depends(get_user_id)):
+async def predict(
+    request: PredictionRequest,
+    background_tasks: BackgroundTasks,
+    explain: Literal["full", "deferred", "none"] = Query("full", description="full: explain inline, deferred: fetch from /explanations/{request_id} later, none: skip SHAP"),
+    explain_mode: Literal["exact", "fast"] = Query("exact", description="exact: TreeSHAP over every tree, fast: reduced tree subset (error reported in /model-info)"),
+    user_id: str = Depends(get_user_id)
+):
     """Make a single prediction"""
     # Check rate limit
     check_rate_limit(user_id)
@@ -237,60 +300,146 @@ async def predict(request: PredictionRequest, user_id: str = Depends(get_user_id
     # Convert request to values list
     values = [getattr(request, feature) for feature in FEATURES]
     
-    # Get prediction and explanation
-    prediction, explanation = get_prediction_with_explanation(values)
-    
     # Generate request ID
     request_id = hashlib.md5(f"{user_id}{time.time()}".encode()).hexdigest()
     
-    # Log prediction
-    log_prediction(user_id, values, prediction, explanation, request_id)
+    if explain == "full":
+        # Get prediction and explanation
+        prediction, explanation = await single_row_inference.call("predict_with_explanation", values, mode=explain_mode)
+        explanation_status = "ready"
+        await record(log_prediction, user_id, values, prediction, explanation, request_id)
+    elif explain == "deferred":
+        # Return the class now and compute SHAP once the response is sent
+        prediction, explanation = await single_row_inference.call("predict", values), {}
+        explanation_status = "pending"
+        store_explanation(request_id, user_id, explanation_status, explanation)
+        background_tasks.add_task(compute_deferred_explanation, request_id, user_id, values, explain_mode)
+    else:
+        prediction, explanation = await single_row_inference.call("predict", values), {}
+        explanation_status = "skipped"
+        await record(log_prediction, user_id, values, prediction, explanation, request_id)
     
     return PredictionResponse(
         prediction=str(prediction),
         confidence="high" if len(explanation) > 0 else "medium",
         explanation=explanation,
+        explanation_status=explanation_status,
         timestamp=datetime.datetime.now().isoformat(),
         request_id=request_id
     )
 
-@app.post("/batch-predict", response_model=BatchPredictionResponse)
-async def batch_predict(request: BatchPredictionRequest, user_id: str = Depends(get_user_id)):
-    """Make batch predictions"""
+@app.get("/explanations/{request_id}", response_model=ExplanationResponse)
+def get_explanation(request_id: str, user_id: str = Depends(get_user_id)):
+    """Fetch the SHAP explanation of a prediction made with explain=deferred"""
+    with EXPLANATIONS_LOCK:
+        entry = EXPLANATIONS.get(request_id)
+        if entry is not None and entry["seq"] is not None and history.committed >= entry["seq"]:
+            del EXPLANATIONS[request_id]
+            entry = None
+    if entry is None:
+        # Finished explanations, including those computed by other workers, live in the history
+        rows = db.query("SELECT user_id, explanation FROM predictions WHERE request_id = ?", (request_id,))
+        if rows:
+            row_user_id, blob = rows[0]
+            explanation = decode_explanation(blob)
+            entry = {"user_id": row_user_id, "status": "ready" if explanation else "failed", "explanation": explanation}
+    if entry is None or entry["user_id"] != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No deferred explanation found for this request_id"
+        )
+    
+    result = ExplanationResponse(request_id=request_id, status=entry["status"], explanation=entry["explanation"])
+    if entry["status"] == "pending":
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=result.model_dump())
+    return result
+
+@app.post(
+    "/batch-predict",
+    response_model=BatchPredictionResponse,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": BatchPredictionRequest.model_json_schema(ref_template="#/components/schemas/{model}")},
+                RAW_MEDIA_TYPE: {"schema": {"type": "string", "format": "binary"}},
+                NPY_MEDIA_TYPE: {"schema": {"type": "string", "format": "binary"}}
+            }
+        }
+    }
+)
+async def batch_predict(
+    http_request: Request,
+    explain_mode: Literal["exact", "fast"] = Query("exact", description="exact: TreeSHAP over every tree, fast: reduced tree subset"),
+    user_id: str = Depends(get_user_id)
+):
+    """Make batch predictions from JSON, or from a float32 matrix (raw or .npy) answered in the same format"""
     # Check rate limit
     check_rate_limit(user_id)
     
+    media_type = http_request.headers.get("content-type", "application/json").split(";")[0].strip()
+    if media_type in BINARY_MEDIA_TYPES:
+        return await batch_predict_binary(await read_binary_body(http_request, media_type), media_type, user_id)
+    body = await http_request.body()
+    try:
+        request = BatchPredictionRequest.model_validate_json(body)
+    except ValidationError as e:
+        # Same shape of 422 as a declared body parameter would give
+        raise RequestValidationError([
+            {**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)
+        ])
+    
     start_time = time.time()
-    results = []
-    successful = 0
-    failed = 0
+    results = [None] * len(request.data)
+    valid_rows = []
+    valid_positions = []
+    logged_rows = []
     
+    # Collect every valid row into one matrix
     for i, pred_request in enumerate(request.data):
         try:
-            # Convert request to values list
-            values = [getattr(pred_request, feature) for feature in FEATURES]
-            
-            # Get prediction and explanation
-            prediction, explanation = get_prediction_with_explanation(values)
-            
-            results.append({
-                "row": i + 1,
-                "prediction": str(prediction),
-                "explanation": explanation,
-                "status": "success"
-            })
-            successful += 1
-            
+            valid_rows.append([float(getattr(pred_request, feature)) for feature in FEATURES])
+            valid_positions.append(i)
         except Exception as e:
-            results.append({
+            results[i] = {
                 "row": i + 1,
                 "error": str(e),
                 "status": "failed"
-            })
-            failed += 1
+            }
+    
+    # One predict and one SHAP call for the whole batch
+    if valid_rows:
+        try:
+            predictions, explanations = await inference_pool.call(
+                "predict_batch_with_explanations", valid_rows, mode=explain_mode
+            )
+            for i, prediction, explanation in zip(valid_positions, predictions, explanations):
+                results[i] = {
+                    "row": i + 1,
+                    "prediction": str(prediction),
+                    "explanation": explanation,
+                    "status": "success"
+                }
+            logged_rows = list(zip(valid_rows, predictions, explanations))
+        except PoolSaturated:
+            raise
+        except Exception as e:
+            for i in valid_positions:
+                results[i] = {
+                    "row": i + 1,
+                    "error": str(e),
+                    "status": "failed"
+                }
+    
+    successful = sum(1 for result in results if result["status"] == "success")
+    failed = len(results) - successful
     
     processing_time = time.time() - start_time
     
+    # Every successful row plus the batch timing, committed together
+    batch_id = hashlib.md5(f"{user_id}{start_time}".encode()).hexdigest()
+    await record(log_batch, batch_id, user_id, logged_rows, explain_mode, len(request.data), processing_time, rows=len(logged_rows) + 1)
+    
     return BatchPredictionResponse(
         results=results,
         total_processed=len(request.data),
@@ -299,47 +448,389 @@ async def batch_predict(request: BatchPredictionRequest, user_id: str = Depends(
         processing_time=processing_time
     )
 
+class RequestStreamingResponse(StreamingResponse):
+    """StreamingResponse whose body iterator is still reading the request
+
+    StreamingResponse normally watches receive() for a disconnect while it
+    streams, which would swallow the request body chunks the iterator waits
+    for; here the iterator sees the disconnect itself through request.stream().
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+def binary_batch_too_large():
+    """413 for a binary batch over BINARY_BATCH_MAX_ROWS"""
+    return HTTPException(
+        status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+        detail=f"At most {BINARY_BATCH_MAX_ROWS} rows per binary batch; use /batch-predict/stream for more"
+    )
+
+async def read_binary_body(http_request, media_type):
+    """Read a binary batch body, refusing it as soon as it is known to exceed BINARY_BATCH_MAX_ROWS"""
+    max_size = max_body_size(BINARY_BATCH_MAX_ROWS, media_type)
+    content_length = http_request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > max_size:
+        raise binary_batch_too_large()
+    body = bytearray()
+    async for data in http_request.stream():
+        body += data
+        if len(body) > max_size:
+            raise binary_batch_too_large()
+        # The raw header declares the row count up front
+        if media_type == RAW_MEDIA_TYPE and (raw_row_count(body) or 0) > BINARY_BATCH_MAX_ROWS:
+            raise binary_batch_too_large()
+    return bytes(body)
+
+async def batch_predict_binary(body, media_type, user_id):
+    """Predict a binary float32 matrix without per-row parsing; failed rows come back as FAILED_PREDICTION
+
+    Explanations are not computed in this format. Totals are sent as X-* headers.
+    """
+    start_time = time.time()
+    try:
+        X = read_matrix(body, media_type)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if len(X) > BINARY_BATCH_MAX_ROWS:
+        raise binary_batch_too_large()
+    
+    # One vectorised range check for the whole matrix
+    valid = validate_matrix(X)
+    predictions = np.full(len(X), FAILED_PREDICTION, dtype=np.int32)
+    logged_rows = []
+    if valid.any():
+        valid_rows = X[valid].astype(np.float64)
+        valid_predictions = await inference_pool.call("predict_batch", valid_rows)
+        predictions[valid] = valid_predictions
+        logged_rows = [(values, prediction, {}) for values, prediction in zip(valid_rows.tolist(), valid_predictions)]
+    
+    processing_time = time.time() - start_time
+    batch_id = hashlib.md5(f"{user_id}{start_time}".encode()).hexdigest()
+    await record(log_batch, batch_id, user_id, logged_rows, "none", len(X), processing_time, rows=len(logged_rows) + 1)
+    
+    return Response(
+        content=write_predictions(predictions, media_type),
+        media_type=media_type,
+        headers={
+            "X-Total-Processed": str(len(X)),
+            "X-Successful": str(len(logged_rows)),
+            "X-Failed": str(len(X) - len(logged_rows)),
+            "X-Processing-Time": f"{processing_time:.6f}"
+        }
+    )
+
+async def ndjson_lines(request):
+    """Yield the non-blank lines of a request body as they arrive"""
+    pending = b""
+    async for data in request.stream():
+        pending += data
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if pending.strip():
+        yield pending
+
+def parse_stream_row(line):
+    """Read one NDJSON row, either an object keyed by feature or an array in FEATURES order"""
+    row = json.loads(line)
+    if isinstance(row, dict):
+        missing = [feature for feature in FEATURES if feature not in row]
+        if missing:
+            raise ValueError(f"Missing features: {', '.join(missing)}")
+        row = [row[feature] for feature in FEATURES]
+    if not isinstance(row, list) or len(row) != len(FEATURES):
+        raise ValueError(f"Expected an object or an array of {len(FEATURES)} values")
+    return [float(value) for value in row]
+
+async def score_stream_chunk(chunk, explain_mode):
+    """Predict one chunk of parsed (row, values, error) entries with a single model call
+
+    Returns the result dicts in row order and the (values, prediction, explanation)
+    rows to log.
+    """
+    results = {}
+    parsed = [(row, values) for row, values, error in chunk if error is None]
+    for row, _, error in chunk:
+        if error is not None:
+            results[row] = {"row": row, "error": error, "status": "failed"}
+    
+    logged_rows = []
+    if parsed:
+        X = np.array([values for _, values in parsed], dtype=np.float64)
+        valid = validate_matrix(X)
+        for (row, values), ok in zip(parsed, valid):
+            if not ok:
+                errors = validate_input(values) or ["Values must be finite numbers"]
+                results[row] = {"row": row, "error": "; ".join(errors), "status": "failed"}
+        
+        rows = [row for (row, _), ok in zip(parsed, valid) if ok]
+        if rows:
+            X = X[valid]
+            try:
+                # The request was already admitted, so later chunks wait for a free slot
+                if explain_mode == "none":
+                    predictions = await inference_pool.call("predict_batch", X, wait=True)
+                    explanations = [{} for _ in rows]
+                else:
+                    predictions, explanations = await inference_pool.call(
+                        "predict_batch_with_explanations", X, mode=explain_mode, wait=True
+                    )
+                for row, prediction, explanation in zip(rows, predictions, explanations):
+                    results[row] = {"row": row, "prediction": str(prediction), "status": "success"}
+                    if explain_mode != "none":
+                        results[row]["explanation"] = explanation
+                logged_rows = list(zip(X.tolist(), predictions, explanations))
+            except Exception as e:
+                for row in rows:
+                    results[row] = {"row": row, "error": str(e), "status": "failed"}
+    
+    return [results[row] for row, _, _ in chunk], logged_rows
+
+async def stream_batch_results(request, user_id, explain_mode, batch_id):
+    """Read, score and answer an NDJSON batch one chunk at a time, ending with a summary line"""
+    start_time = time.time()
+    total = successful = 0
+    chunk = []
+    lines = ndjson_lines(request)
+    while True:
+        line = await anext(lines, None)
+        if line is not None:
+            total += 1
+            try:
+                chunk.append((total, parse_stream_row(line), None))
+            except Exception as e:
+                chunk.append((total, None, str(e)))
+            if len(chunk) < BATCH_STREAM_CHUNK_ROWS:
+                continue
+        if chunk:
+            results, logged_rows = await score_stream_chunk(chunk, explain_mode)
+            successful += len(logged_rows)
+            await record(log_batch_rows, batch_id, user_id, logged_rows, rows=len(logged_rows))
+            yield "".join(json.dumps(result) + "\n" for result in results)
+            chunk = []
+        if line is None:
+            break
+    
+    processing_time = time.time() - start_time
+    await record(log_batch_run, batch_id, user_id, explain_mode, total, successful, processing_time)
+    yield json.dumps({
+        "batch_id": batch_id,
+        "total_processed": total,
+        "successful": successful,
+        "failed": total - successful,
+        "processing_time": processing_time
+    }) + "\n"
+
+@app.post("/batch-predict/stream")
+async def batch_predict_stream(
+    request: Request,
+    explain_mode: Literal["exact", "fast", "none"] = Query("exact", description="exact: TreeSHAP over every tree, fast: reduced tree subset, none: predictions only"),
+    user_id: str = Depends(get_user_id)
+):
+    """Score an NDJSON body of any length, streaming NDJSON results back chunk by chunk
+
+    Each input line is an object keyed by feature name or an array of values in
+    FEATURES order. Each output line is a result in the /batch-predict format,
+    and the last line is a summary with the batch totals.
+    """
+    check_rate_limit(user_id)
+    
+    batch_id = hashlib.md5(f"{user_id}{time.time()}".encode()).hexdigest()
+    return RequestStreamingResponse(
+        stream_batch_results(request, user_id, explain_mode, batch_id),
+        media_type="application/x-ndjson"
+    )
+
+async def score_csv_chunks(upload, user_id, batch_id):
+    """Predict an uploaded CSV chunk by chunk, yielding (first_row, X, predictions, errors)
+
+    Parsing runs off the event loop since it reads the spooled upload file.
+    Successful rows are logged per chunk and the batch_runs entry at the end.
+    """
+    start_time = time.time()
+    total = successful = 0
+    chunks = read_csv_chunks(io.TextIOWrapper(upload.file, encoding="utf-8-sig"))
+    while True:
+        chunk = await run_in_threadpool(next, chunks, None)
+        if chunk is None:
+            break
+        first_row, X, errors = chunk
+        predictions = [None] * len(X)
+        valid = [offset for offset in range(len(X)) if offset not in errors]
+        if valid:
+            try:
+                # The request was already admitted, so later chunks wait for a free slot
+                valid_predictions = await inference_pool.call("predict_batch", X[valid], wait=True)
+            except Exception as e:
+                for offset in valid:
+                    errors[offset] = str(e)
+                valid = []
+        if valid:
+            for offset, prediction in zip(valid, valid_predictions):
+                predictions[offset] = str(prediction)
+            logged_rows = [(values, prediction, {}) for values, prediction in zip(X[valid].tolist(), valid_predictions)]
+            await record(log_batch_rows, batch_id, user_id, logged_rows, rows=len(logged_rows))
+        total += len(X)
+        successful += len(valid)
+        yield first_row, X, predictions, errors
+    await record(log_batch_run, batch_id, user_id, "none", total, successful, time.time() - start_time)
+
+@app.post("/batch-predict/csv")
+async def batch_predict_csv(
+    file: UploadFile = File(..., description="CSV with a header row in the Multiclass_Diabetes_Dataset.csv layout"),
+    download: bool = Query(False, description="Return the input rows with prediction and error columns as a CSV file"),
+    user_id: str = Depends(get_user_id)
+):
+    """Score an uploaded CSV in chunks, returning /batch-predict style results or a scored CSV download"""
+    check_rate_limit(user_id)
+    
+    start_time = time.time()
+    batch_id = hashlib.md5(f"{user_id}{start_time}".encode()).hexdigest()
+    chunks = score_csv_chunks(file, user_id, batch_id)
+    # Read the header and first chunk up front so a malformed file is a 400, not a broken stream
+    try:
+        first = await anext(chunks, None)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    async def scored_chunks():
+        if first is not None:
+            yield first
+        async for chunk in chunks:
+            yield chunk
+    
+    if download:
+        async def scored_file():
+            yield ",".join(SCORED_COLUMNS) + "\n"
+            async for _, X, predictions, errors in scored_chunks():
+                yield scored_csv(X, predictions, errors)
+        
+        return StreamingResponse(
+            scored_file(),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="scored.csv"'}
+        )
+    
+    results = []
+    async for first_row, X, predictions, errors in scored_chunks():
+        for offset, prediction in enumerate(predictions):
+            if prediction is None:
+                results.append({"row": first_row + offset, "error": errors[offset], "status": "failed"})
+            else:
+                results.append({"row": first_row + offset, "prediction": prediction, "status": "success"})
+    successful = sum(1 for result in results if result["status"] == "success")
+    
+    return BatchPredictionResponse(
+        results=results,
+        total_processed=len(results),
+        successful=successful,
+        failed=len(results) - successful,
+        processing_time=time.time() - start_time
+    )
+
+def export_chunks(rows, fmt):
+    """Render history rows as NDJSON or CSV text, one chunk per EXPORT_CHUNK_ROWS rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == "csv":
+        writer.writerow(EXPORT_COLUMNS)
+    for i, row in enumerate(rows, 1):
+        row["explanation"] = decode_explanation(row["explanation"])
+        if fmt == "ndjson":
+            buffer.write(json.dumps(row) + "\n")
+        else:
+            writer.writerow([json.dumps(row[c]) if c == "explanation" else row[c] for c in EXPORT_COLUMNS])
+        if i % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+@app.get("/history/export")
+def export_history(
+    fmt: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    start: Optional[datetime.datetime] = Query(None, description="Only rows at or after this ISO timestamp"),
+    end: Optional[datetime.datetime] = Query(None, description="Only rows before this ISO timestamp"),
+    prediction: Optional[int] = Query(None, description="Only rows predicted as this class"),
+    source: Optional[Literal[SOURCES]] = Query(None, description="Only rows logged by this front end"),
+    user: Optional[str] = Query(None, description="User whose rows to export; other users and all users need an admin token"),
+    user_id: str = Depends(get_user_id)
+):
+    """Stream prediction history as NDJSON or CSV, page by page"""
+    check_rate_limit(user_id)
+    
+    is_admin = user_id in EXPORT_ADMIN_USER_IDS
+    if user is not None and user != user_id and not is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only admins can export other users' history"
+        )
+    # Admins get every user's rows unless they ask for one
+    target_user = user if user is not None else (None if is_admin else user_id)
+    
+    rows = iter_history(
+        db, "predictions",
+        start=start.isoformat() if start else None,
+        end=end.isoformat() if end else None,
+        user_id=target_user,
+        prediction=prediction,
+        source=source
+    )
+    return StreamingResponse(
+        export_chunks(rows, fmt),
+        media_type="application/x-ndjson" if fmt == "ndjson" else "text/csv",
+        headers={"Content-Disposition": f'attachment; filename="predictions.{fmt}"'}
+    )
+
 @app.get("/stats")
-async def get_statistics(user_id: str = Depends(get_user_id)):
+def get_statistics(user_id: str = Depends(get_user_id)):
     """Get API usage statistics"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
     # Get total predictions
-    c.execute("SELECT COUNT(*) FROM api_history")
-    total_predictions = c.fetchone()[0]
+    total_predictions = aggregates.total_count(db, "api")
     
     # Get predictions by class
-    c.execute("SELECT prediction, COUNT(*) FROM api_history GROUP BY prediction")
-    class_counts = dict(c.fetchall())
+    class_counts = aggregates.class_counts(db, "api")
     
     # Get recent predictions
-    c.execute("SELECT timestamp, prediction FROM api_history ORDER BY timestamp DESC LIMIT 10")
-    recent = c.fetchall()
+    recent = aggregates.recent_predictions(db, "api")
     
     # Get user-specific stats
-    c.execute("SELECT COUNT(*) FROM api_history WHERE user_id=?", (user_id,))
-    user_predictions = c.fetchone()[0]
-    
-    conn.close()
+    user_predictions = aggregates.user_count(db, "api", user_id)
     
     return {
         "total_predictions": total_predictions,
         "user_predictions": user_predictions,
         "class_distribution": class_counts,
         "recent_predictions": recent,
-        "rate_limit_remaining": MAX_REQUESTS - len(RATE_LIMIT[user_id])
+        "source_distribution": aggregates.source_counts(db),
+        "rate_limit_remaining": RATE_LIMIT.remaining(user_id),
+        "rate_limiter": RATE_LIMIT.stats(),
+        "prediction_cache": engine.cache.stats(),
+        "history_writer": history.stats(),
+        "inference_pool": inference_pool.stats()
     }
 
+@app.get("/metrics/batching")
+async def get_batching_metrics():
+    """Batch-size distribution and queueing delay of the micro-batching scheduler"""
+    if micro_batcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **micro_batcher.stats()}
+
 @app.get("/model-info")
 async def get_model_info():
     """Get information about the trained model"""
     return {
-        "model_type": type(model).__name__,
+        "model_type": type(engine.model).__name__,
         "features": FEATURES,
         "feature_ranges": FEATURE_RANGES,
         "training_date": "2024-01-01",  # You can store this in the model
         "accuracy": "95.2%",  # You can store this in the model
+        "fast_explanation": engine.fast_explanation_report,
         "version": "1.0.0"
     }
 
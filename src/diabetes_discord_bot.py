@@ -1,60 +1,41 @@
 import discord
-import joblib
-import numpy as np
-import pandas as pd
 import os
-import sqlite3
 from dotenv import load_dotenv
 import logging
-import shap
-import datetime
 import json
+from collections import OrderedDict
+
+from inference import FEATURES, MODEL_PATH, InferenceEngine, PredictionCache, validate_input
+from storage import DB_PATH, AsyncStore, Database, HistoryWriter, decode_explanation
+from storage import aggregates
+from storage.partitions import recent_history
 
 # Load environment variables
 load_dotenv()
 TOKEN = os.getenv('DISCORD_BOT_TOKEN')
 ADMIN_USER_IDS = os.getenv('ADMIN_USER_IDS', '').split(',')
+# Explanation mode for !explain; set to 'fast' to trade a measured error for latency
+EXPLAIN_MODE = os.getenv('EXPLAIN_MODE', 'exact')
 
 # Set up logging
 logging.basicConfig(filename='bot.log', level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
 
-# SQLite setup
-DB_PATH = os.path.join(os.path.dirname(__file__), 'user_history.db')
-conn = sqlite3.connect(DB_PATH)
-c = conn.cursor()
-c.execute('''
-    CREATE TABLE IF NOT EXISTS history (
-        user_id TEXT,
-        timestamp TEXT,
-        command TEXT,
-        input TEXT,
-        prediction TEXT,
-        explanation TEXT
-    )
-''')
-conn.commit()
-
-# Load the trained model
-MODEL_PATH = os.path.join(os.path.dirname(__file__), 'diabetes_model.pkl')
-model = joblib.load(MODEL_PATH)
+# SQLite setup: persistent per-thread connections, schema created once here
+db = Database(DB_PATH)
+# History rows are queued and inserted in bulk by a background thread
+history = HistoryWriter(db)
+# Reads run on their own thread so the gateway event loop never waits on disk
+store = AsyncStore(db, history)
 
-# Define the features expected by the model
-FEATURES = ['Gender', 'AGE', 'Urea', 'Cr', 'HbA1c', 'Chol', 'TG', 'HDL', 'LDL', 'VLDL', 'BMI']
+# Per-user !stats results, dropped when the user logs a new prediction
+STATS_CACHE = OrderedDict()
+MAX_CACHED_STATS = int(os.getenv('STATS_CACHE_SIZE', '10000'))
+# Writer sequence number of each user's latest queued history row
+PENDING_WRITES = {}
 
-# Feature validation ranges (min, max)
-FEATURE_RANGES = {
-    'Gender': (0, 1),
-    'AGE': (18, 100),
-    'Urea': (1.0, 50.0),
-    'Cr': (5, 1000),
-    'HbA1c': (3.0, 15.0),
-    'Chol': (1.0, 10.0),
-    'TG': (0.1, 50.0),
-    'HDL': (0.1, 5.0),
-    'LDL': (0.1, 10.0),
-    'VLDL': (0.1, 50.0),
-    'BMI': (15.0, 50.0)
-}
+# Load the trained model and its explainer through the shared inference engine,
+# with repeated inputs served from the prediction cache
+engine = InferenceEngine(MODEL_PATH, cache=PredictionCache())
 
 intents = discord.Intents.default()
 intents.message_content = True
@@ -89,33 +70,32 @@ async def send_welcome_message():
                 continue
         break
 
-def validate_input(values):
-    """Validate input values against expected ranges"""
-    errors = []
-    for i, (feature, value) in enumerate(zip(FEATURES, values)):
-        min_val, max_val = FEATURE_RANGES[feature]
-        if value < min_val or value > max_val:
-            errors.append(f"{feature}: {value} (should be between {min_val} and {max_val})")
-    return errors
-
-def get_user_stats(user_id):
+async def get_user_stats(user_id):
     """Get user statistics"""
-    c.execute("SELECT COUNT(*) FROM history WHERE user_id=?", (user_id,))
-    total_predictions = c.fetchone()[0]
+    stats = STATS_CACHE.get(user_id)
+    if stats is not None:
+        STATS_CACHE.move_to_end(user_id)
+        return stats
     
-    c.execute("SELECT prediction FROM history WHERE user_id=?", (user_id,))
-    predictions = [row[0] for row in c.fetchall()]
+    # Taken before the query, so a commit landing while it runs can't pass for one it saw
+    committed = history.committed
+    class_counts = await store.run(aggregates.user_class_counts, db, 'discord', user_id)
     
-    if predictions:
-        class_counts = {}
-        for pred in predictions:
-            class_counts[pred] = class_counts.get(pred, 0) + 1
-        
-        most_common = max(class_counts.items(), key=lambda x: x[1])
+    if class_counts:
+        total_predictions = sum(count for _, count in class_counts)
+        most_common = class_counts[0]
         stats = f"Total predictions: {total_predictions}\nMost common class: {most_common[0]} ({most_common[1]} times)"
     else:
         stats = "No predictions yet"
     
+    # Only cache once the user's latest prediction is committed, or the
+    # cached counts would miss it until their next prediction
+    if committed >= PENDING_WRITES.get(user_id, 0):
+        PENDING_WRITES.pop(user_id, None)
+        STATS_CACHE[user_id] = stats
+        while len(STATS_CACHE) > MAX_CACHED_STATS:
+            STATS_CACHE.popitem(last=False)
+    
     return stats
 
 async def notify_admins(message):
@@ -156,7 +136,7 @@ async def on_message(message):
         return
 
     if content.startswith('!stats'):
-        stats = get_user_stats(user_id)
+        stats = await get_user_stats(user_id)
         await message.channel.send(f'📊 **Your Statistics:**\n{stats}')
         return
 
@@ -186,16 +166,17 @@ async def on_message(message):
         return
 
     if content.startswith('!history'):
-        c.execute("SELECT timestamp, command, input, prediction, explanation FROM history WHERE user_id=? ORDER BY timestamp DESC LIMIT 5", (user_id,))
-        rows = c.fetchall()
+        # Newest rows first, reaching into older partitions when this month has fewer than 5
+        rows = await store.run(recent_history, db, 'predictions', user_id, 5, source='discord')
         if not rows:
             await message.channel.send("No history found for you.")
         else:
             history_msg = "**Your last 5 predictions:**\n"
             for row in rows:
-                history_msg += f"\n- `{row[0][:19]}` `{row[1]}`\n  Input: {row[2]}\n  Prediction: {row[3]}\n"
-                if row[4]:
-                    history_msg += f"  Explanation: {row[4]}\n"
+                input_str = " ".join(f"{row[feature]:g}" for feature in FEATURES if row[feature] is not None)
+                history_msg += f"\n- `{row['timestamp'][:19]}` `{row['command']}`\n  Input: {input_str}\n  Prediction: {row['prediction']}\n"
+                if row['explanation']:
+                    history_msg += f"  Explanation: {format_explanation(decode_explanation(row['explanation']))}\n"
             await message.channel.send(history_msg)
         return
 
@@ -223,51 +204,41 @@ async def on_message(message):
                 await message.channel.send(error_msg + '\nUse `!validate` to check your data before predicting.')
                 return
             
-            # Create DataFrame with feature names to avoid warning
-            values_df = pd.DataFrame([values], columns=FEATURES)
-            pred = model.predict(values_df)[0]
-            explanation = ""
+            top_features = {}
             
             if content.startswith('!predict'):
+                pred = engine.predict(values)
                 await message.channel.send(f'✅ Predicted diabetes class: **{pred}**')
             elif content.startswith('!explain'):
                 # SHAP explainability
-                try:
-                    explainer = shap.TreeExplainer(model)
-                    shap_values = explainer.shap_values(values_df)
-                    # For multiclass, pick the predicted class
-                    if isinstance(shap_values, list):
-                        class_idx = int(pred)
-                        shap_val = shap_values[class_idx][0]
-                    else:
-                        shap_val = shap_values[0]
-                    # Get top 3 features
-                    top_idx = np.argsort(np.abs(shap_val))[::-1][:3]
-                    explanation = '\n'.join([
-                        f"- {FEATURES[i]}: {shap_val[i]:.3f}" for i in top_idx
-                    ])
+                pred, top_features = engine.predict_with_explanation(values, mode=EXPLAIN_MODE)
+                if top_features:
                     await message.channel.send(
-                        f'🔎 **Top features impacting this prediction:**\n{explanation}'
+                        f'🔎 **Top features impacting this prediction:**\n{format_explanation(top_features)}'
                     )
-                except Exception as e:
-                    await message.channel.send(f'⚠️ SHAP explanation error: {e}')
-                    logging.error(f'SHAP error: {e}')
+                else:
+                    await message.channel.send('⚠️ SHAP explanation is not available for this input.')
+                    logging.error('SHAP explanation returned no features')
             # Log history
-            log_history(user_id, parts[0], " ".join(parts[1:]), str(pred), explanation)
+            await log_history(user_id, parts[0], values, pred, top_features)
         except Exception as e:
             await message.channel.send(f'⚠️ Error: {e}')
             logging.error(f'Prediction error: {e}')
             await notify_admins(f'Critical error for user {user_id}: {e}')
 
-def log_history(user_id, command, input_str, prediction, explanation):
-    c.execute(
-        "INSERT INTO history (user_id, timestamp, command, input, prediction, explanation) VALUES (?, ?, ?, ?, ?, ?)",
-        (user_id, datetime.datetime.now().isoformat(), command, input_str, prediction, explanation)
-    )
-    conn.commit()
+def format_explanation(explanation):
+    """Render a {feature: value} explanation as one '- feature: value' line per feature"""
+    return '\n'.join(f"- {feature}: {value:.3f}" for feature, value in explanation.items())
+
+async def log_history(user_id, command, values, prediction, explanation):
+    PENDING_WRITES[user_id] = await store.log('discord', user_id, values, prediction, explanation, command=command)
+    STATS_CACHE.pop(user_id, None)
 
 if __name__ == '__main__':
     if not TOKEN:
         print('Error: DISCORD_BOT_TOKEN not set in .env')
     else:
-        client.run(TOKEN) 
\ No newline at end of file
+        try:
+            client.run(TOKEN)
+        finally:
+            store.close() 
\ No newline at end of file
@@ -0,0 +1,26 @@
+from .features import FEATURES, FEATURE_RANGES, validate_input, validate_matrix, to_feature_matrix
+from .forest import CompiledForest
+from .cache import PredictionCache
+from .csv_input import CSV_CHUNK_ROWS, SCORED_COLUMNS, read_csv_chunks, scored_csv
+from .approx import EXPLAIN_MODES, FAST_EXPLAIN_TREES
+from .engine import MODEL_PATH, TOP_K, InferenceEngine, top_k_explanations
+
+__all__ = [
+    'FEATURES',
+    'FEATURE_RANGES',
+    'validate_input',
+    'validate_matrix',
+    'to_feature_matrix',
+    'MODEL_PATH',
+    'TOP_K',
+    'CompiledForest',
+    'PredictionCache',
+    'CSV_CHUNK_ROWS',
+    'SCORED_COLUMNS',
+    'read_csv_chunks',
+    'scored_csv',
+    'EXPLAIN_MODES',
+    'FAST_EXPLAIN_TREES',
+    'InferenceEngine',
+    'top_k_explanations',
+]
@@ -0,0 +1,76 @@
+import copy
+import csv
+import os
+
+import numpy as np
+
+from .features import FEATURES
+
+# Training data used to pick the fast-explanation trees and measure their error
+DATASET_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    'Multiclass_Diabetes_Dataset.csv'
+)
+
+# Number of trees the fast explainer runs TreeSHAP over
+FAST_EXPLAIN_TREES = int(os.getenv('FAST_EXPLAIN_TREES', '10'))
+
+# Explanation modes accepted by the engine
+EXPLAIN_MODES = ('exact', 'fast')
+
+def load_training_features(path=DATASET_PATH):
+    """Read the FEATURES columns of the training CSV as a float array, or None if it is missing"""
+    if not os.path.exists(path):
+        return None
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        columns = [header.index(feature) for feature in FEATURES]
+        return np.array([[float(row[i]) for i in columns] for row in reader if row], dtype=np.float64)
+
+def as_class_array(shap_values):
+    """Normalise shap output to a (rows, features, classes) array"""
+    if isinstance(shap_values, list):
+        return np.stack(shap_values, axis=-1)
+    return np.asarray(shap_values)
+
+def select_trees(model, X, n_trees):
+    """Greedily pick the trees whose averaged SHAP values best match the full forest on X"""
+    import shap
+
+    # SHAP values of a forest are the mean of its trees' SHAP values
+    per_tree = np.stack([as_class_array(shap.TreeExplainer(tree).shap_values(X)) for tree in model.estimators_])
+    exact = per_tree.mean(axis=0)
+
+    selected = []
+    total = np.zeros_like(exact)
+    for k in range(1, min(n_trees, len(per_tree)) + 1):
+        errors = np.abs((total + per_tree) / k - exact).reshape(len(per_tree), -1).mean(axis=1)
+        errors[selected] = np.inf
+        best = int(np.argmin(errors))
+        selected.append(best)
+        total += per_tree[best]
+    return selected, exact, total / len(selected)
+
+def subset_forest(model, tree_indices):
+    """Return a shallow copy of a forest that only keeps the given trees"""
+    subset = copy.copy(model)
+    subset.estimators_ = [model.estimators_[i] for i in tree_indices]
+    subset.n_estimators = len(subset.estimators_)
+    return subset
+
+def measure_deviation(exact, approx, class_idx, top_k):
+    """Summarise how far approximate SHAP values are from exact ones for each row's predicted class"""
+    rows = np.arange(len(class_idx))
+    exact = exact[rows, :, class_idx]
+    approx = approx[rows, :, class_idx]
+    error = np.abs(approx - exact)
+    exact_top = np.sort(np.argsort(np.abs(exact), axis=1)[:, ::-1][:, :top_k], axis=1)
+    approx_top = np.sort(np.argsort(np.abs(approx), axis=1)[:, ::-1][:, :top_k], axis=1)
+    return {
+        'rows': int(len(rows)),
+        'mean_abs_error': float(error.mean()),
+        'max_abs_error': float(error.max()),
+        'relative_error': float(error.sum() / max(np.abs(exact).sum(), 1e-12)),
+        'top_k_agreement': float(np.all(exact_top == approx_top, axis=1).mean())
+    }
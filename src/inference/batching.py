@@ -0,0 +1,118 @@
+import asyncio
+import bisect
+import os
+import time
+from collections import Counter
+
+# Micro-batching configuration; a window of 0 disables the scheduler
+MICROBATCH_WINDOW_MS = float(os.getenv('MICROBATCH_WINDOW_MS', '0'))
+MICROBATCH_MAX_SIZE = int(os.getenv('MICROBATCH_MAX_SIZE', '64'))
+
+# Queueing-delay histogram bucket upper bounds, in milliseconds
+DELAY_BUCKETS_MS = [0.5, 1, 2, 5, 10, 20, 50, 100, 250]
+
+# Single-row engine methods and the batch method that serves them
+BATCH_METHODS = {
+    'predict': 'predict_batch',
+    'predict_with_explanation': 'predict_batch_with_explanations',
+}
+
+class MicroBatcher:
+    """Collects concurrent single-row calls for a short window and runs them as one batch
+
+    call() has the same shape as InferencePool.call() for the single-row methods in
+    BATCH_METHODS. Rows are grouped by method and keyword arguments, flushed after
+    window_ms or as soon as max_batch_size rows are waiting, and each caller gets back
+    its own row's result.
+    """
+
+    def __init__(self, pool, window_ms=MICROBATCH_WINDOW_MS, max_batch_size=MICROBATCH_MAX_SIZE):
+        self.pool = pool
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.pending = {}
+        self.timers = {}
+
+        # Metrics
+        self.batch_sizes = Counter()
+        self.delay_buckets = [0] * (len(DELAY_BUCKETS_MS) + 1)
+        self.delay_total_ms = 0.0
+        self.delay_max_ms = 0.0
+        self.requests = 0
+
+    async def call(self, method, values, wait=False, **kwargs):
+        """Queue one row for the next batch of engine.<method> and wait for its result"""
+        if method not in BATCH_METHODS:
+            raise ValueError(f"Cannot micro-batch {method!r}, expected one of {list(BATCH_METHODS)}")
+
+        loop = asyncio.get_running_loop()
+        key = (method, tuple(sorted(kwargs.items())))
+        future = loop.create_future()
+        batch = self.pending.setdefault(key, [])
+        batch.append((values, future, time.perf_counter(), wait))
+
+        if len(batch) >= self.max_batch_size:
+            self._flush(key)
+        elif len(batch) == 1:
+            self.timers[key] = loop.call_later(self.window, self._flush, key)
+        return await future
+
+    def _flush(self, key):
+        """Take every row waiting under key and start running them as one batch"""
+        timer = self.timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self.pending.pop(key, None)
+        if batch:
+            asyncio.ensure_future(self._run(key, batch))
+
+    async def _run(self, key, batch):
+        """Run one batch on the pool and hand each caller its row's result"""
+        method, kwargs = key
+        started = time.perf_counter()
+        self.record(len(batch), [(started - enqueued) * 1000 for _, _, enqueued, _ in batch])
+
+        rows = [values for values, _, _, _ in batch]
+        wait = any(item_wait for _, _, _, item_wait in batch)
+        try:
+            result = await self.pool.call(BATCH_METHODS[method], rows, wait=wait, **dict(kwargs))
+        except Exception as e:
+            for _, future, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        if method == 'predict':
+            results = list(result)
+        else:
+            results = list(zip(*result))
+        for (_, future, _, _), row_result in zip(batch, results):
+            if not future.done():
+                future.set_result(row_result)
+
+    def record(self, batch_size, delays_ms):
+        """Update the batch-size and queueing-delay metrics"""
+        self.batch_sizes[batch_size] += 1
+        self.requests += batch_size
+        for delay in delays_ms:
+            self.delay_buckets[bisect.bisect_left(DELAY_BUCKETS_MS, delay)] += 1
+            self.delay_total_ms += delay
+            self.delay_max_ms = max(self.delay_max_ms, delay)
+
+    def stats(self):
+        """Return batch-size distribution and queueing-delay metrics"""
+        batches = sum(self.batch_sizes.values())
+        bucket_labels = [f'<={bound}ms' for bound in DELAY_BUCKETS_MS] + [f'>{DELAY_BUCKETS_MS[-1]}ms']
+        return {
+            'window_ms': self.window * 1000,
+            'max_batch_size': self.max_batch_size,
+            'batches': batches,
+            'requests': self.requests,
+            'mean_batch_size': self.requests / batches if batches else 0.0,
+            'batch_size_distribution': dict(sorted(self.batch_sizes.items())),
+            'queue_delay_ms': {
+                'mean': self.delay_total_ms / self.requests if self.requests else 0.0,
+                'max': self.delay_max_ms,
+                'histogram': dict(zip(bucket_labels, self.delay_buckets))
+            }
+        }
@@ -0,0 +1,67 @@
+import io
+import struct
+
+import numpy as np
+
+from .features import FEATURES
+
+# Binary batch formats, chosen by Content-Type: a raw little-endian float32
+# matrix behind a small header, or a NumPy .npy file
+RAW_MEDIA_TYPE = 'application/octet-stream'
+NPY_MEDIA_TYPE = 'application/x-npy'
+BINARY_MEDIA_TYPES = (RAW_MEDIA_TYPE, NPY_MEDIA_TYPE)
+
+# Raw header: magic, row count, column count; values or predictions follow in row-major order
+HEADER = struct.Struct('<4sII')
+MATRIX_MAGIC = b'DMX1'  # float32 feature matrix, columns in FEATURES order
+PREDICTION_MAGIC = b'DPR1'  # one int32 prediction per row
+
+# Prediction written for rows that failed the range check
+FAILED_PREDICTION = -1
+
+# Room allowed for the .npy preamble and header dict on top of the values
+NPY_HEADER_ALLOWANCE = 4096
+
+def max_body_size(max_rows, media_type):
+    """Largest body that can hold max_rows rows; .npy may carry float64 values"""
+    if media_type == NPY_MEDIA_TYPE:
+        return NPY_HEADER_ALLOWANCE + max_rows * len(FEATURES) * 8
+    return HEADER.size + max_rows * len(FEATURES) * 4
+
+def raw_row_count(body):
+    """Row count declared by a raw body's header, or None until the header has arrived"""
+    if len(body) < HEADER.size:
+        return None
+    return HEADER.unpack_from(body)[1]
+
+def read_matrix(body, media_type):
+    """Decode a binary request body into a (rows, features) float32 matrix"""
+    if media_type == NPY_MEDIA_TYPE:
+        try:
+            X = np.load(io.BytesIO(body), allow_pickle=False)
+        except (EOFError, OSError) as e:
+            # np.load signals empty, truncated or non-.npy input this way
+            raise ValueError(f'Not a valid .npy body: {e}')
+        if X.dtype.kind != 'f':
+            raise ValueError(f'Expected a float array, got {X.dtype}')
+    else:
+        if len(body) < HEADER.size:
+            raise ValueError('Body is shorter than the header')
+        magic, rows, columns = HEADER.unpack_from(body)
+        if magic != MATRIX_MAGIC:
+            raise ValueError(f'Bad magic {magic!r}, expected {MATRIX_MAGIC!r}')
+        if len(body) != HEADER.size + rows * columns * 4:
+            raise ValueError(f'Body holds {len(body) - HEADER.size} bytes of values, expected {rows * columns * 4}')
+        X = np.frombuffer(body, dtype='<f4', offset=HEADER.size).reshape(rows, columns)
+    if X.ndim != 2 or X.shape[1] != len(FEATURES):
+        raise ValueError(f'Expected a (rows, {len(FEATURES)}) matrix, got shape {X.shape}')
+    return X
+
+def write_predictions(predictions, media_type):
+    """Encode an int32 prediction per row in the format of the request"""
+    predictions = np.asarray(predictions, dtype='<i4')
+    if media_type == NPY_MEDIA_TYPE:
+        buffer = io.BytesIO()
+        np.save(buffer, predictions, allow_pickle=False)
+        return buffer.getvalue()
+    return HEADER.pack(PREDICTION_MAGIC, len(predictions), 1) + predictions.tobytes()
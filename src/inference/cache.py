@@ -0,0 +1,73 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Cache configuration
+CACHE_SIZE = int(os.getenv('PREDICTION_CACHE_SIZE', '4096'))
+CACHE_TTL = float(os.getenv('PREDICTION_CACHE_TTL', '3600'))  # seconds
+# Round feature values to this many decimals before keying; unset means exact match
+CACHE_DECIMALS = os.getenv('PREDICTION_CACHE_DECIMALS')
+
+class PredictionCache:
+    """Bounded LRU cache of (prediction, explanation) results with a per-entry TTL"""
+
+    def __init__(self, max_size=CACHE_SIZE, ttl=CACHE_TTL, decimals=CACHE_DECIMALS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.decimals = None if decimals in (None, '') else int(decimals)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def make_keys(self, X, model_version, variant):
+        """Build one cache key per row of a 2D feature array
+
+        variant covers anything else that changes the result, such as the
+        explanation mode and top_k.
+        """
+        if self.decimals is not None:
+            X = np.round(X, self.decimals)
+        return [(model_version, variant, tuple(row)) for row in np.asarray(X, dtype=np.float64).tolist()]
+
+    def get(self, key):
+        """Return the cached result for key, or None on a miss or an expired entry"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """Store a result, evicting the least recently used entries past max_size"""
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        """Drop every cached result"""
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl
+            }
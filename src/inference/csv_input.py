@@ -0,0 +1,91 @@
+import csv
+import io
+import itertools
+import os
+
+import numpy as np
+
+from .features import FEATURES, validate_input, validate_matrix
+
+# Data rows parsed per chunk of an uploaded CSV
+CSV_CHUNK_ROWS = int(os.getenv('CSV_CHUNK_ROWS', '5000'))
+
+# Columns of a scored CSV download
+SCORED_COLUMNS = FEATURES + ['prediction', 'error']
+
+def feature_columns(header):
+    """Positions of FEATURES in a CSV header row laid out like Multiclass_Diabetes_Dataset.csv"""
+    names = [name.strip() for name in header.split(',')]
+    missing = [feature for feature in FEATURES if feature not in names]
+    if missing:
+        raise ValueError(f"CSV is missing columns: {', '.join(missing)}")
+    return [names.index(feature) for feature in FEATURES]
+
+def parse_csv_lines(lines, columns):
+    """Parse data lines into a feature matrix; rows that fail are NaN and returned as {offset: error}"""
+    try:
+        # Fast path: the whole chunk is clean numeric CSV
+        return np.loadtxt(lines, delimiter=',', usecols=columns, ndmin=2, dtype=np.float64), {}
+    except ValueError:
+        pass
+    X = np.full((len(lines), len(FEATURES)), np.nan)
+    errors = {}
+    for offset, line in enumerate(lines):
+        fields = line.split(',')
+        try:
+            X[offset] = [float(fields[i]) for i in columns]
+        except IndexError:
+            errors[offset] = 'Row has too few columns'
+        except ValueError as e:
+            errors[offset] = f'Could not parse row: {e}'
+    return X, errors
+
+def read_csv_chunks(lines, chunk_rows=CSV_CHUNK_ROWS):
+    """Parse an iterable of CSV text lines, header first, chunk_rows data rows at a time
+
+    Yields (first_row, X, errors): first_row is the 1-based number of the
+    chunk's first data row, X its (rows, features) matrix and errors maps row
+    offsets within the chunk to a parse or range error. Blank lines are skipped.
+    A header that can't be read raises ValueError; if reading fails later on,
+    the rows read so far are yielded and then a last one-row chunk holding the
+    error.
+    """
+    lines = iter(lines)
+    header = next(lines, None)
+    if header is None:
+        raise ValueError('CSV is empty')
+    columns = feature_columns(header)
+    first_row = 1
+    data_lines = (line for line in lines if line.strip())
+    failure = None
+    while failure is None:
+        chunk = []
+        try:
+            for line in itertools.islice(data_lines, chunk_rows):
+                chunk.append(line)
+        except (ValueError, OSError) as e:
+            # Undecodable bytes or a broken upload part way through the file
+            failure = f'Stopped reading the CSV: {e}'
+        if chunk:
+            X, errors = parse_csv_lines(chunk, columns)
+            valid = validate_matrix(X)
+            for offset in np.flatnonzero(~valid).tolist():
+                if offset not in errors:
+                    errors[offset] = '; '.join(validate_input(X[offset].tolist()) or ['Values must be finite numbers'])
+            yield first_row, X, errors
+            first_row += len(chunk)
+        elif failure is None:
+            break
+    if failure is not None:
+        yield first_row, np.full((1, len(FEATURES)), np.nan), {0: failure}
+
+def scored_csv(X, predictions, errors):
+    """Render one scored chunk as CSV text in SCORED_COLUMNS order; predictions holds None for failed rows"""
+    buffer = io.StringIO()
+    # Same line ending as the header row the servers write
+    writer = csv.writer(buffer, lineterminator='\n')
+    for offset, (values, prediction) in enumerate(zip(X.tolist(), predictions)):
+        # Unparsed values are NaN and written as empty fields
+        fields = ['' if np.isnan(v) else f'{v:g}' for v in values]
+        writer.writerow(fields + ['' if prediction is None else prediction, errors.get(offset, '')])
+    return buffer.getvalue()
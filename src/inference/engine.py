@@ -0,0 +1,246 @@
+import os
+import threading
+import time
+import warnings
+
+import joblib
+import numpy as np
+
+from .features import FEATURES, FEATURE_RANGES, to_feature_matrix
+from .forest import CompiledForest
+from .approx import (
+    EXPLAIN_MODES, FAST_EXPLAIN_TREES, load_training_features, measure_deviation, select_trees, subset_forest
+)
+
+# Default location of the trained model, next to the front-end scripts
+MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'diabetes_model.pkl')
+# Compiled forest exported by train_model.py alongside it
+FOREST_PATH = os.path.join(os.path.dirname(MODEL_PATH), 'diabetes_forest.npz')
+
+# Number of features reported in an explanation
+TOP_K = 5
+
+# Warning sklearn gives for the plain arrays the model is fed (see check_feature_order)
+FEATURE_NAMES_WARNING = 'X does not have valid feature names'
+
+# Largest batch sent to the compiled forest; it walks every tree for every row
+# at once, so bigger batches are faster (and lighter) through sklearn
+COMPILED_FOREST_MAX_ROWS = int(os.getenv('COMPILED_FOREST_MAX_ROWS', '256'))
+
+# How often (seconds) to check the model file for changes
+MODEL_CHECK_INTERVAL = float(os.getenv('MODEL_CHECK_INTERVAL', '1.0'))
+
+class InferenceEngine:
+    """Owns the loaded model and its SHAP explainer and serves predictions for every front end"""
+
+    def __init__(self, model_path=MODEL_PATH, explain=True, cache=None, forest_path=FOREST_PATH):
+        self.model_path = model_path
+        self.forest_path = forest_path
+        self.explain = explain
+        self.cache = cache
+        self.explainer_lock = threading.Lock()
+        self.reload_lock = threading.Lock()
+        self.load_model()
+
+    def model_file_version(self):
+        """Identify the model file on disk by its modification time and size"""
+        stat = os.stat(self.model_path)
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    def load_model(self):
+        """Load the model file and rebuild everything derived from it"""
+        version = self.model_file_version()
+        self.model = joblib.load(self.model_path)
+        self.check_feature_order()
+        self.classes = self.model.classes_
+        self.forest = self.compile_forest()
+        self.explainer = self.build_explainer(self.model) if self.explain else None
+        self.fast_explainer, self.fast_explanation_report = (
+            self.build_fast_explainer() if self.explain else (None, None)
+        )
+        self.model_version = version
+        self.last_model_check = time.monotonic()
+        if self.cache is not None:
+            self.cache.clear()
+
+    def reload_if_changed(self):
+        """Reload the model (and drop cached results) when the model file has changed"""
+        if time.monotonic() - self.last_model_check < MODEL_CHECK_INTERVAL:
+            return
+        with self.reload_lock:
+            self.last_model_check = time.monotonic()
+            try:
+                changed = self.model_file_version() != self.model_version
+            except OSError:
+                return
+            if changed:
+                self.load_model()
+
+    def check_feature_order(self):
+        """Make sure the model was trained on FEATURES in the same order"""
+        # Rows are fed to the estimator as plain ordered arrays, so this is checked
+        # once here instead of building a DataFrame on every call
+        trained_features = list(getattr(self.model, 'feature_names_in_', FEATURES))
+        if trained_features != FEATURES:
+            raise RuntimeError(f"Model features {trained_features} do not match expected order {FEATURES}")
+
+    def compile_forest(self):
+        """Flatten a random forest into node arrays, keeping it only if it reproduces the model exactly"""
+        if not hasattr(self.model, 'estimators_') or not hasattr(self.model, 'predict_proba'):
+            return None
+        low = [FEATURE_RANGES[f][0] for f in FEATURES]
+        high = [FEATURE_RANGES[f][1] for f in FEATURES]
+        middle = [(a + b) / 2 for a, b in zip(low, high)]
+        X = np.array([low, middle, high], dtype=np.float64)
+        # Reuse the exported forest when it was built from this model
+        forest = self.load_exported_forest()
+        if forest is not None and self.forest_matches(forest, X):
+            return forest
+        try:
+            forest = CompiledForest.from_sklearn(self.model)
+        except AttributeError:
+            return None
+        if not self.forest_matches(forest, X):
+            warnings.warn('Compiled forest does not match the model, falling back to sklearn predict')
+            return None
+        return forest
+
+    def forest_matches(self, forest, X):
+        """Compare a compiled forest with the model on X, which has no feature names"""
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', message=FEATURE_NAMES_WARNING, category=UserWarning)
+            return forest.matches(self.model, X)
+
+    def load_exported_forest(self):
+        """Load the forest saved by train_model.py if it has the model's trees and nodes, else None"""
+        if not os.path.exists(self.forest_path):
+            return None
+        try:
+            forest = CompiledForest.load(self.forest_path)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            warnings.warn(f'Could not load {self.forest_path}: {e}')
+            return None
+        node_count = sum(estimator.tree_.node_count for estimator in self.model.estimators_)
+        if len(forest.roots) != len(self.model.estimators_) or len(forest.feature) != node_count:
+            return None
+        return forest
+
+    def build_explainer(self, model):
+        """Create a TreeExplainer for a model and warm it up with one call"""
+        import shap
+
+        explainer = shap.TreeExplainer(model)
+        warmup_row = [(low + high) / 2 for low, high in (FEATURE_RANGES[f] for f in FEATURES)]
+        explainer.shap_values(np.array([warmup_row]))
+        return explainer
+
+    def build_fast_explainer(self):
+        """Build a TreeExplainer over a small subset of trees and measure its error on the training set"""
+        n_trees = len(getattr(self.model, 'estimators_', []))
+        if FAST_EXPLAIN_TREES <= 0 or FAST_EXPLAIN_TREES >= n_trees:
+            return None, None
+
+        X = load_training_features()
+        if X is None:
+            # Without training data the trees can't be chosen or the error measured
+            tree_indices, report = list(range(FAST_EXPLAIN_TREES)), {'rows': 0}
+        else:
+            tree_indices, exact, approx = select_trees(self.model, X, FAST_EXPLAIN_TREES)
+            class_idx = np.searchsorted(self.classes, self.predict_matrix(X))
+            report = measure_deviation(exact, approx, class_idx, TOP_K)
+
+        report.update({'trees': len(tree_indices), 'total_trees': n_trees})
+        return self.build_explainer(subset_forest(self.model, tree_indices)), report
+
+    def predict_matrix(self, X):
+        """Predict a 2D feature array, using the compiled forest for small batches when available"""
+        if self.forest is not None and len(X) <= COMPILED_FOREST_MAX_ROWS:
+            return self.forest.predict(X)
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', message=FEATURE_NAMES_WARNING, category=UserWarning)
+            return self.model.predict(X)
+
+    def predict_batch(self, rows):
+        """Predict the class of every row with one model call"""
+        self.reload_if_changed()
+        return self.predict_matrix(to_feature_matrix(rows))
+
+    def predict(self, values):
+        """Predict the class of a single row"""
+        rows = values if isinstance(values, np.ndarray) else [values]
+        return self.predict_batch(rows)[0]
+
+    def select_class_shap(self, shap_values, preds):
+        """Pick the SHAP values of each row's predicted class as a (rows, features) matrix"""
+        class_idx = np.searchsorted(self.classes, preds)
+        rows = np.arange(len(class_idx))
+        if isinstance(shap_values, list):
+            return np.stack(shap_values)[class_idx, rows]
+        if np.ndim(shap_values) == 3:
+            return shap_values[rows, :, class_idx]
+        return np.asarray(shap_values)
+
+    def explain_batch(self, X, preds, top_k=TOP_K, mode='exact'):
+        """Get the top-k SHAP attributions of each row's predicted class"""
+        explainer = self.fast_explainer if mode == 'fast' and self.fast_explainer is not None else self.explainer
+        with self.explainer_lock:
+            shap_values = explainer.shap_values(X)
+        return top_k_explanations(self.select_class_shap(shap_values, preds), top_k)
+
+    def _predict_and_explain(self, X, top_k, mode):
+        """Run the model and the explainer on a 2D feature array"""
+        preds = self.predict_matrix(X)
+        try:
+            explanations = self.explain_batch(X, preds, top_k, mode)
+        except Exception:
+            explanations = [{} for _ in range(len(preds))]
+        return preds, explanations
+
+    def predict_batch_with_explanations(self, rows, top_k=TOP_K, mode='exact'):
+        """Get predictions and SHAP explanations for many rows with one model and one SHAP call
+
+        mode='fast' explains with the reduced tree subset; its measured error is in
+        fast_explanation_report.
+        """
+        if mode not in EXPLAIN_MODES:
+            raise ValueError(f"Unknown explanation mode {mode!r}, expected one of {EXPLAIN_MODES}")
+        self.reload_if_changed()
+        X = to_feature_matrix(rows)
+        if self.cache is None:
+            return self._predict_and_explain(X, top_k, mode)
+
+        # Serve repeated inputs from the cache and only run the model on the misses
+        keys = self.cache.make_keys(X, self.model_version, (mode, top_k))
+        preds = np.empty(len(keys), dtype=self.classes.dtype)
+        explanations = [None] * len(keys)
+        misses = []
+        for i, key in enumerate(keys):
+            cached = self.cache.get(key)
+            if cached is None:
+                misses.append(i)
+            else:
+                preds[i], explanations[i] = cached[0], dict(cached[1])
+
+        if misses:
+            miss_preds, miss_explanations = self._predict_and_explain(X[misses], top_k, mode)
+            for i, pred, explanation in zip(misses, miss_preds, miss_explanations):
+                preds[i], explanations[i] = pred, explanation
+                # Don't pin a failed explanation in the cache
+                if explanation or self.explainer is None:
+                    self.cache.put(keys[i], (pred, dict(explanation)))
+        return preds, explanations
+
+    def predict_with_explanation(self, values, top_k=TOP_K, mode='exact'):
+        """Get prediction and SHAP explanation for a single row"""
+        rows = values if isinstance(values, np.ndarray) else [values]
+        preds, explanations = self.predict_batch_with_explanations(rows, top_k, mode)
+        return preds[0], explanations[0]
+
+def top_k_explanations(shap_matrix, k=TOP_K):
+    """Turn a (rows, features) SHAP matrix into per-row {feature: value} dicts of the top k"""
+    top_idx = np.argsort(np.abs(shap_matrix), axis=1)[:, ::-1][:, :k]
+    top_vals = np.take_along_axis(shap_matrix, top_idx, axis=1)
+    return [
+        {FEATURES[i]: float(v) for i, v in zip(idx_row, val_row)}
+        for idx_row, val_row in zip(top_idx.tolist(), top_vals.tolist())
+    ]
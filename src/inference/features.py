@@ -0,0 +1,43 @@
+import numpy as np
+
+# Define the features expected by the model, in training order
+FEATURES = ['Gender', 'AGE', 'Urea', 'Cr', 'HbA1c', 'Chol', 'TG', 'HDL', 'LDL', 'VLDL', 'BMI']
+
+# Feature validation ranges (min, max)
+FEATURE_RANGES = {
+    'Gender': (0, 1),
+    'AGE': (18, 100),
+    'Urea': (1.0, 50.0),
+    'Cr': (5, 1000),
+    'HbA1c': (3.0, 15.0),
+    'Chol': (1.0, 10.0),
+    'TG': (0.1, 50.0),
+    'HDL': (0.1, 5.0),
+    'LDL': (0.1, 10.0),
+    'VLDL': (0.1, 50.0),
+    'BMI': (15.0, 50.0)
+}
+FEATURE_MIN = np.array([FEATURE_RANGES[feature][0] for feature in FEATURES], dtype=np.float64)
+FEATURE_MAX = np.array([FEATURE_RANGES[feature][1] for feature in FEATURES], dtype=np.float64)
+
+def validate_input(values):
+    """Validate input values against expected ranges"""
+    errors = []
+    for feature, value in zip(FEATURES, values):
+        min_val, max_val = FEATURE_RANGES[feature]
+        if value < min_val or value > max_val:
+            errors.append(f"{feature}: {value} (should be between {min_val} and {max_val})")
+    return errors
+
+def validate_matrix(X):
+    """Flag the rows of a 2D feature array whose values are all within range (NaN never is)"""
+    return ((X >= FEATURE_MIN) & (X <= FEATURE_MAX)).all(axis=1)
+
+def to_feature_matrix(rows):
+    """Turn ordered value rows, or objects with one attribute per feature, into a 2D float array"""
+    if isinstance(rows, np.ndarray) and rows.dtype in (np.float32, np.float64):
+        return rows.reshape(-1, len(FEATURES))
+    return np.array([
+        row if isinstance(row, (list, tuple, np.ndarray)) else [getattr(row, feature) for feature in FEATURES]
+        for row in rows
+    ], dtype=np.float64)
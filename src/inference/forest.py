@@ -0,0 +1,112 @@
+import numpy as np
+
+class CompiledForest:
+    """A random forest flattened into contiguous node arrays and evaluated for a whole batch at once
+
+    Predictions match sklearn's RandomForestClassifier bit for bit: inputs are cast to
+    float32 like sklearn does, nodes are split on ``x <= threshold`` in float64, and the
+    per-tree class distributions are summed in estimator order before averaging.
+    """
+
+    def __init__(self, feature, threshold, left, right, missing_left, value, roots, classes, max_depth):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing_left = missing_left
+        self.value = value
+        self.roots = roots
+        self.classes = classes
+        self.max_depth = int(max_depth)
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """Flatten a fitted RandomForestClassifier into node arrays"""
+        n_classes = len(model.classes_)
+        features, thresholds, lefts, rights, missing_lefts, values, roots = [], [], [], [], [], [], []
+        offset = 0
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            node_ids = np.arange(tree.node_count)
+            is_leaf = tree.children_left == -1
+
+            # Leaves point at themselves so every row can be walked for max_depth steps
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(np.where(is_leaf, 0.0, tree.threshold))
+            lefts.append(np.where(is_leaf, node_ids, tree.children_left) + offset)
+            rights.append(np.where(is_leaf, node_ids, tree.children_right) + offset)
+            missing_left = getattr(tree, 'missing_go_to_left', None)
+            missing_lefts.append(np.zeros(tree.node_count, dtype=bool) if missing_left is None else missing_left.astype(bool))
+
+            # Older sklearn stores class counts in the leaves and normalises them in predict_proba
+            value = tree.value[:, 0, :n_classes].astype(np.float64)
+            normalizer = value.sum(axis=1)
+            if not np.allclose(normalizer[is_leaf], 1.0):
+                normalizer[normalizer == 0.0] = 1.0
+                value = value / normalizer[:, np.newaxis]
+            values.append(value)
+
+            roots.append(offset)
+            offset += tree.node_count
+
+        return cls(
+            feature=np.ascontiguousarray(np.concatenate(features), dtype=np.intp),
+            threshold=np.ascontiguousarray(np.concatenate(thresholds), dtype=np.float64),
+            left=np.ascontiguousarray(np.concatenate(lefts), dtype=np.intp),
+            right=np.ascontiguousarray(np.concatenate(rights), dtype=np.intp),
+            missing_left=np.ascontiguousarray(np.concatenate(missing_lefts)),
+            value=np.ascontiguousarray(np.concatenate(values)),
+            roots=np.array(roots, dtype=np.intp),
+            classes=np.asarray(model.classes_),
+            max_depth=max(estimator.tree_.max_depth for estimator in model.estimators_),
+        )
+
+    def save(self, path):
+        """Export the node arrays to a .npz file"""
+        np.savez(
+            path,
+            feature=self.feature,
+            threshold=self.threshold,
+            left=self.left,
+            right=self.right,
+            missing_left=self.missing_left,
+            value=self.value,
+            roots=self.roots,
+            classes=self.classes,
+            max_depth=np.array(self.max_depth),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Load node arrays exported with save()"""
+        with np.load(path) as data:
+            return cls(**{name: data[name] for name in data.files})
+
+    def apply(self, X):
+        """Return the leaf reached in every tree as a (trees, rows) array of node ids"""
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(X.shape[0])
+        nodes = np.repeat(self.roots[:, np.newaxis], X.shape[0], axis=1)
+        for _ in range(self.max_depth):
+            x = X[rows, self.feature[nodes]]
+            go_left = np.where(np.isnan(x), self.missing_left[nodes], x <= self.threshold[nodes])
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return nodes
+
+    def predict_proba(self, X):
+        """Average the leaf class distributions of all trees"""
+        leaf_values = self.value[self.apply(X)]
+        proba = np.zeros(leaf_values.shape[1:], dtype=np.float64)
+        # Summed tree by tree in estimator order, exactly like sklearn's accumulation
+        for tree_proba in leaf_values:
+            proba += tree_proba
+        proba /= len(self.roots)
+        return proba
+
+    def predict(self, X):
+        """Predict the class of every row"""
+        return self.classes.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+
+    def matches(self, model, X):
+        """Check that this forest reproduces the model's probabilities exactly on X"""
+        return np.array_equal(self.predict_proba(X), model.predict_proba(X))
@@ -0,0 +1,103 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Inference pool configuration
+INFERENCE_POOL = os.getenv('INFERENCE_POOL', 'thread')  # 'thread' or 'process'
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', str(min(4, os.cpu_count() or 1))))
+INFERENCE_QUEUE_SIZE = int(os.getenv('INFERENCE_QUEUE_SIZE', '32'))  # waiting calls on top of running ones
+INFERENCE_RETRY_AFTER = int(os.getenv('INFERENCE_RETRY_AFTER', '1'))  # seconds
+
+class PoolSaturated(Exception):
+    """Raised when every worker is busy and the wait queue is full"""
+
+    def __init__(self, retry_after=INFERENCE_RETRY_AFTER):
+        super().__init__('Inference pool is saturated')
+        self.retry_after = retry_after
+
+# Engine owned by a process-pool worker, created by _init_worker
+_worker_engine = None
+
+def _init_worker(model_path, use_cache):
+    """Load a private engine in each worker process"""
+    global _worker_engine
+    from .cache import PredictionCache
+    from .engine import InferenceEngine
+
+    _worker_engine = InferenceEngine(model_path, cache=PredictionCache() if use_cache else None)
+
+def _call_worker_engine(method, args, kwargs):
+    """Run an engine method inside a worker process"""
+    return getattr(_worker_engine, method)(*args, **kwargs)
+
+class InferencePool:
+    """Runs engine calls on a thread or process pool so they never block the event loop
+
+    At most workers + queue_size calls are admitted at once; past that, call() raises
+    PoolSaturated instead of queueing without bound.
+    """
+
+    def __init__(self, engine, kind=INFERENCE_POOL, workers=INFERENCE_WORKERS, queue_size=INFERENCE_QUEUE_SIZE):
+        if kind not in ('thread', 'process'):
+            raise ValueError(f"Unknown inference pool kind {kind!r}, expected 'thread' or 'process'")
+        self.engine = engine
+        self.kind = kind
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.in_flight = 0
+        self.rejected = 0
+        self._slots = None
+        if kind == 'thread':
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='inference')
+        else:
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(engine.model_path, engine.cache is not None)
+            )
+
+    @property
+    def slots(self):
+        # Created lazily so the semaphore belongs to the running event loop
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.capacity)
+        return self._slots
+
+    async def call(self, method, *args, wait=False, **kwargs):
+        """Run engine.<method>(*args, **kwargs) on the pool
+
+        With wait=False a full pool raises PoolSaturated; with wait=True the caller
+        waits for a free slot instead.
+        """
+        if not wait and self.slots.locked():
+            self.rejected += 1
+            raise PoolSaturated()
+
+        async with self.slots:
+            self.in_flight += 1
+            try:
+                loop = asyncio.get_running_loop()
+                if self.kind == 'thread':
+                    task = functools.partial(getattr(self.engine, method), *args, **kwargs)
+                else:
+                    task = functools.partial(_call_worker_engine, method, args, kwargs)
+                return await loop.run_in_executor(self.executor, task)
+            finally:
+                self.in_flight -= 1
+
+    def stats(self):
+        """Return pool occupancy counters"""
+        return {
+            'kind': self.kind,
+            'workers': self.workers,
+            'capacity': self.capacity,
+            'in_flight': self.in_flight,
+            'rejected': self.rejected
+        }
+
+    def shutdown(self):
+        """Stop the workers"""
+        self.executor.shutdown(wait=True)
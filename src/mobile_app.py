@@ -1,6 +1,4 @@
 import os
-import joblib
-import pandas as pd
 import datetime
 from kivy.metrics import dp
 from kivy.storage.jsonstore import JsonStore
@@ -22,6 +20,12 @@ from kivymd.uix.scrollview import MDScrollView
 from kivymd.uix.divider import MDDivider
 from kivymd.uix.gridlayout import MDGridLayout
 
+from inference import FEATURES, FEATURE_RANGES, InferenceEngine, validate_input
+
+# Optionally also log predictions to the shared history database as source 'mobile'
+MOBILE_HISTORY_SYNC = os.getenv('MOBILE_HISTORY_SYNC', '').lower() in ('1', 'true', 'yes')
+MOBILE_USER_ID = os.getenv('MOBILE_USER_ID', 'mobile')
+
 # Clean & Organized KV Design
 KV = '''
 MDScreen:
@@ -235,15 +239,15 @@ MDScreen:
 class DiabetesApp(MDApp):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.features = ['Gender', 'AGE', 'Urea', 'Cr', 'HbA1c', 'Chol', 'TG', 'HDL', 'LDL', 'VLDL', 'BMI']
-        self.feature_ranges = {
-            'Gender': (0, 1), 'AGE': (18, 100), 'Urea': (1.0, 50.0), 'Cr': (5, 1000),
-            'HbA1c': (3.0, 15.0), 'Chol': (1.0, 10.0), 'TG': (0.1, 50.0), 'HDL': (0.1, 5.0),
-            'LDL': (0.1, 10.0), 'VLDL': (0.1, 50.0), 'BMI': (15.0, 50.0)
-        }
+        self.features = FEATURES
+        self.feature_ranges = FEATURE_RANGES
         self.inputs = {}
-        self.model = None
+        self.engine = None
         self.store = JsonStore('diabetes_predictions.json')
+        self.history = None
+        if MOBILE_HISTORY_SYNC:
+            from storage import DB_PATH, Database, HistoryWriter
+            self.history = HistoryWriter(Database(DB_PATH))
 
     def build(self):
         self.theme_cls.primary_palette = "Blue"
@@ -260,9 +264,10 @@ class DiabetesApp(MDApp):
         model_paths = ['diabetes_model.pkl', 'src/diabetes_model.pkl', '../diabetes_model.pkl']
         for path in model_paths:
             if os.path.exists(path):
-                self.model = joblib.load(path)
+                # The app only shows the class, so skip building the SHAP explainer
+                self.engine = InferenceEngine(path, explain=False)
                 break
-        if not self.model:
+        if not self.engine:
             self.show_error("Model not found!")
 
     def build_form(self):
@@ -409,8 +414,7 @@ class DiabetesApp(MDApp):
             return
         
         progress.value = 60
-        values_df = pd.DataFrame([values], columns=self.features)
-        prediction = self.model.predict(values_df)[0]
+        prediction = self.engine.predict(values)
         progress.value = 100
         health_info = self.get_health_status(prediction)
         self.show_results(health_info, prediction)
@@ -601,12 +605,7 @@ class DiabetesApp(MDApp):
         results_box.add_widget(desc_card)
 
     def validate_input(self, values):
-        errors = []
-        for i, (feature, value) in enumerate(zip(self.features, values)):
-            min_val, max_val = self.feature_ranges[feature]
-            if value < min_val or value > max_val:
-                errors.append(f"{feature}: {value} (should be between {min_val} and {max_val})")
-        return errors
+        return validate_input(values)
 
     def save_prediction(self, values, prediction, health_info):
         timestamp = datetime.datetime.now().isoformat()
@@ -624,6 +623,13 @@ class DiabetesApp(MDApp):
         if len(predictions) > 50:
             predictions = predictions[-50:]
         self.store.put('predictions', data=predictions)
+        if self.history is not None:
+            self.history.log('mobile', MOBILE_USER_ID, values, prediction, {})
+
+    def on_stop(self):
+        if self.history is not None:
+            self.history.close()
+            self.history.db.close()
 
     def on_history(self):
         if not self.store.exists('predictions'):
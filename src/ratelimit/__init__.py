@@ -0,0 +1,8 @@
+from .limiter import SlidingWindowLimiter
+from .backends import RATE_LIMIT_BACKEND, create_limiter
+
+__all__ = [
+    'SlidingWindowLimiter',
+    'RATE_LIMIT_BACKEND',
+    'create_limiter',
+]
@@ -0,0 +1,19 @@
+import os
+
+from .limiter import SlidingWindowLimiter
+
+# 'memory': limits per process, 'shared': one limit across every process on the host
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+
+BACKENDS = ('memory', 'shared')
+
+def create_limiter(max_requests, window, backend=RATE_LIMIT_BACKEND):
+    """Build the rate limiter for a backend name"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown rate limit backend {backend!r}, expected one of {BACKENDS}")
+    if backend == 'shared':
+        # fcntl is POSIX-only, so only load it when asked for
+        from .shared import SharedWindowLimiter
+
+        return SharedWindowLimiter(max_requests, window)
+    return SlidingWindowLimiter(max_requests, window)
@@ -0,0 +1,98 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+def roll_window(state, now, window):
+    """Advance (window_start, current_count, previous_count) to the fixed window containing now"""
+    start, current, previous = state
+    elapsed_windows = int((now - start) // window)
+    if elapsed_windows < 1:
+        return state
+    previous = current if elapsed_windows == 1 else 0
+    return (start + elapsed_windows * window, 0, previous)
+
+def window_estimate(state, now, window):
+    """Requests counted against the sliding window ending at now, for a rolled state"""
+    start, current, previous = state
+    return previous * (1 - (now - start) / window) + current
+
+def window_expired(state, now, window):
+    """Whether a state has not been touched for two windows, so every count in it has expired"""
+    return now - state[0] >= 2 * window
+
+class SlidingWindowLimiter:
+    """Per-key sliding-window-counter rate limiter with constant-time checks
+
+    Each key keeps three numbers: the start of its current fixed window and the
+    request counts of that window and the one before it. The request rate over
+    the last window is estimated by weighting the previous count by how much of
+    it still overlaps the sliding window. Keys are kept in least recently seen
+    order so idle ones, whose counts have fully expired, are evicted from the
+    front as new requests come in.
+
+    State lives in this process only; see SharedWindowLimiter for limits
+    enforced across processes.
+    """
+
+    def __init__(self, max_requests, window):
+        self.max_requests = max_requests
+        self.window = window
+        # key -> (window_start, current_count, previous_count)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+        self.evicted = 0
+
+    def _evict_idle(self, now):
+        """Drop keys from the front while their counts have fully expired"""
+        while self.entries:
+            key, state = next(iter(self.entries.items()))
+            if not window_expired(state, now, self.window):
+                break
+            del self.entries[key]
+            self.evicted += 1
+
+    def hit(self, key):
+        """Count one request for key and return whether it is within the limit"""
+        now = time.monotonic()
+        with self.lock:
+            state = self.entries.get(key)
+            if state is None:
+                state = (now, 0, 0)
+            else:
+                self.entries.move_to_end(key)
+                state = roll_window(state, now, self.window)
+            allowed = window_estimate(state, now, self.window) + 1 <= self.max_requests
+            if allowed:
+                state = (state[0], state[1] + 1, state[2])
+                self.allowed += 1
+            else:
+                self.rejected += 1
+            self.entries[key] = state
+            self._evict_idle(now)
+            return allowed
+
+    def remaining(self, key):
+        """Requests key may still make right now, without counting one"""
+        now = time.monotonic()
+        with self.lock:
+            state = self.entries.get(key)
+            if state is None:
+                return self.max_requests
+            state = roll_window(state, now, self.window)
+            return max(0, math.floor(self.max_requests - window_estimate(state, now, self.window)))
+
+    def stats(self):
+        """Return limit settings, tracked keys and decision counters"""
+        with self.lock:
+            return {
+                'backend': 'memory',
+                'max_requests': self.max_requests,
+                'window': self.window,
+                'tracked_users': len(self.entries),
+                'allowed': self.allowed,
+                'rejected': self.rejected,
+                'evicted': self.evicted
+            }
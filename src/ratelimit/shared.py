@@ -0,0 +1,207 @@
+import contextlib
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from .limiter import roll_window, window_estimate, window_expired
+
+# Memory-mapped counter table shared by every process on the host; under
+# /dev/shm it lives in RAM, so checks never wait on the disk
+RATE_LIMIT_SHARED_PATH = os.getenv(
+    'RATE_LIMIT_SHARED_PATH',
+    os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'diabetes_rate_limit')
+)
+RATE_LIMIT_SLOTS = int(os.getenv('RATE_LIMIT_SLOTS', '65536'))  # users tracked at once
+
+# File layout: a header, then an open-addressing hash table of per-user slots
+MAGIC = b'RLv2'
+OLD_MAGICS = (b'RLv1',)  # earlier layouts, reset on open
+HEADER = struct.Struct('<4sI5Qd')  # magic, slots, allowed, rejected, evicted, overflowed, live, last_sweep
+ALLOWED, REJECTED, EVICTED, OVERFLOWED, LIVE, LAST_SWEEP = range(2, 8)
+SLOT = struct.Struct('<QdII')  # key hash (0 = empty), window_start, current_count, previous_count
+EMPTY_SLOT = (0, 0.0, 0, 0)
+
+# Every key sits at most MAX_PROBE slots past its home slot, so a lookup never reads more
+MAX_PROBE = 32
+# New users are only admitted while at most this share of the slots is in use, keeping probe chains short
+MAX_LOAD = 0.75
+# Least time between two full sweeps of expired slots once the table reaches MAX_LOAD
+# (shorter windows sweep once per window)
+SWEEP_INTERVAL = 60.0  # seconds
+
+def key_hash(key):
+    """Non-zero 64-bit hash of a rate limit key"""
+    value = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little')
+    return value or 1
+
+class SharedWindowLimiter:
+    """Sliding-window-counter rate limiter whose counts are shared between processes
+
+    Same window arithmetic as SlidingWindowLimiter, with the per-user slots kept
+    in a memory-mapped file so every uvicorn worker enforces one exact limit.
+    Updates are serialised with an flock on that file. Slots are found by
+    linear probing capped at MAX_PROBE. Expired slots met while probing are
+    emptied by backward-shift deletion, and a full sweep rebuilds the table
+    when it is too full to admit new users. New users that still find no free
+    slot are let through and counted as overflowed rather than locked out.
+    """
+
+    def __init__(self, max_requests, window, path=RATE_LIMIT_SHARED_PATH, slots=RATE_LIMIT_SLOTS):
+        self.max_requests = max_requests
+        self.window = window
+        self.path = path
+        self.sweep_interval = min(SWEEP_INTERVAL, window)
+        # flock does not exclude threads sharing this descriptor
+        self.lock = threading.Lock()
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            size = os.fstat(self.fd).st_size
+            if size == 0 or os.pread(self.fd, 4, 0) in OLD_MAGICS:
+                os.ftruncate(self.fd, 0)
+                os.ftruncate(self.fd, HEADER.size + slots * SLOT.size)
+                os.pwrite(self.fd, HEADER.pack(MAGIC, slots, 0, 0, 0, 0, 0, 0.0), 0)
+            magic, self.slots = HEADER.unpack(os.pread(self.fd, HEADER.size, 0))[:2]
+            if magic != MAGIC:
+                raise ValueError(f'{path} is not a rate limit table')
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.table = mmap.mmap(self.fd, HEADER.size + self.slots * SLOT.size)
+
+    @contextlib.contextmanager
+    def _locked(self, operation):
+        """Hold the thread lock and an flock on the table"""
+        with self.lock:
+            fcntl.flock(self.fd, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def _read(self, index):
+        """Unpack one slot as (hash, window_start, current_count, previous_count)"""
+        return SLOT.unpack_from(self.table, HEADER.size + index * SLOT.size)
+
+    def _write(self, index, slot):
+        """Pack one slot"""
+        SLOT.pack_into(self.table, HEADER.size + index * SLOT.size, *slot)
+
+    def _delete(self, index, header):
+        """Empty a slot by backward-shift deletion, so every later key stays reachable from its home"""
+        hole = index
+        probe = index
+        for _ in range(self.slots - 1):
+            probe = (probe + 1) % self.slots
+            slot = self._read(probe)
+            if slot[0] == 0:
+                break
+            # The entry may fill the hole when the hole lies on its path from home to here
+            if (probe - slot[0] % self.slots) % self.slots >= (probe - hole) % self.slots:
+                self._write(hole, slot)
+                hole = probe
+        self._write(hole, EMPTY_SLOT)
+        header[LIVE] -= 1
+
+    def _find(self, hashed, now, header=None):
+        """Return (slot index, state) for hashed, or (empty index or None, None) if it has no slot
+
+        With a header to update, expired slots on the way are deleted; without
+        one (read-only callers) they are skipped.
+        """
+        index = hashed % self.slots
+        for _ in range(MAX_PROBE):
+            slot_hash, *state = self._read(index)
+            if slot_hash == hashed:
+                return index, tuple(state)
+            if slot_hash == 0:
+                return index, None
+            if header is not None and window_expired(state, now, self.window):
+                # Deleting shifts a later entry into this slot, so look at it again
+                self._delete(index, header)
+                header[EVICTED] += 1
+                continue
+            index = (index + 1) % self.slots
+        return None, None
+
+    def _sweep(self, now, header):
+        """Rebuild the table from its unexpired slots"""
+        kept = [
+            slot for slot in SLOT.iter_unpack(self.table[HEADER.size:])
+            if slot[0] and not window_expired(slot[1:], now, self.window)
+        ]
+        header[EVICTED] += header[LIVE] - len(kept)
+        self.table[HEADER.size:] = bytes(self.slots * SLOT.size)
+        header[LIVE] = 0
+        for slot in kept:
+            index, state = self._find(slot[0], now)
+            if index is None:
+                header[EVICTED] += 1
+                continue
+            self._write(index, slot)
+            header[LIVE] += 1
+        header[LAST_SWEEP] = now
+
+    def hit(self, key):
+        """Count one request for key and return whether it is within the limit"""
+        hashed = key_hash(key)
+        now = time.time()
+        with self._locked(fcntl.LOCK_EX):
+            header = list(HEADER.unpack_from(self.table, 0))
+            index, state = self._find(hashed, now, header)
+            if state is None and header[LIVE] >= self.slots * MAX_LOAD and now - header[LAST_SWEEP] >= self.sweep_interval:
+                self._sweep(now, header)
+                index, state = self._find(hashed, now, header)
+            if state is None and (index is None or header[LIVE] >= self.slots * MAX_LOAD):
+                header[OVERFLOWED] += 1
+                HEADER.pack_into(self.table, 0, *header)
+                return True
+            if state is None:
+                header[LIVE] += 1
+                state = (now, 0, 0)
+            else:
+                state = roll_window(state, now, self.window)
+            allowed = window_estimate(state, now, self.window) + 1 <= self.max_requests
+            if allowed:
+                state = (state[0], state[1] + 1, state[2])
+            header[ALLOWED if allowed else REJECTED] += 1
+            self._write(index, (hashed, *state))
+            HEADER.pack_into(self.table, 0, *header)
+            return allowed
+
+    def remaining(self, key):
+        """Requests key may still make right now, without counting one"""
+        now = time.time()
+        with self._locked(fcntl.LOCK_SH):
+            _, state = self._find(key_hash(key), now)
+        if state is None:
+            return self.max_requests
+        state = roll_window(state, now, self.window)
+        return max(0, math.floor(self.max_requests - window_estimate(state, now, self.window)))
+
+    def stats(self):
+        """Return limit settings, slots in use and decision counters across every process"""
+        with self._locked(fcntl.LOCK_SH):
+            header = HEADER.unpack_from(self.table, 0)
+        return {
+            'backend': 'shared',
+            'path': self.path,
+            'max_requests': self.max_requests,
+            'window': self.window,
+            'slots': self.slots,
+            'tracked_users': header[LIVE],
+            'allowed': header[ALLOWED],
+            'rejected': header[REJECTED],
+            'evicted': header[EVICTED],
+            'overflowed': header[OVERFLOWED]
+        }
+
+    def close(self):
+        """Unmap the table and close its file; the counts stay for other processes"""
+        self.table.close()
+        os.close(self.fd)
@@ -0,0 +1,19 @@
+from .async_store import AsyncStore
+from .codec import decode_explanation, encode_explanation, prediction_row
+from .database import DB_PATH, Database
+from .schema import SCHEMA_VERSION, SOURCES, insert_statement
+from .writer import HistoryWriteError, HistoryWriter
+
+__all__ = [
+    'DB_PATH',
+    'SCHEMA_VERSION',
+    'SOURCES',
+    'AsyncStore',
+    'Database',
+    'HistoryWriteError',
+    'HistoryWriter',
+    'decode_explanation',
+    'encode_explanation',
+    'insert_statement',
+    'prediction_row',
+]
@@ -0,0 +1,44 @@
+# Reads of the trigger-maintained aggregates in schema.AGGREGATE_TABLES; each
+# touches a handful of rows however large the history grows. source=None
+# combines every front end.
+
+from .schema import RECENT_SIZE
+
+def source_filter(source, prefix='WHERE'):
+    """SQL condition and parameters restricting an aggregate to one source"""
+    if source is None:
+        return '', ()
+    return f'{prefix} source=?', (source,)
+
+def class_counts(db, source=None):
+    """Number of predictions per class"""
+    where, params = source_filter(source)
+    return dict(db.query(f"SELECT prediction, SUM(count) FROM history_class_counts {where} GROUP BY prediction", params))
+
+def total_count(db, source=None):
+    """Number of predictions logged"""
+    where, params = source_filter(source)
+    return db.query(f"SELECT COALESCE(SUM(count), 0) FROM history_class_counts {where}", params)[0][0]
+
+def source_counts(db):
+    """Number of predictions logged by each front end"""
+    return dict(db.query("SELECT source, SUM(count) FROM history_class_counts GROUP BY source"))
+
+def user_class_counts(db, source, user_id):
+    """Number of predictions per class logged for one user, most common first"""
+    where, params = source_filter(source, 'AND')
+    return db.query(
+        f"SELECT prediction, SUM(count) FROM history_user_counts WHERE user_id=? {where} "
+        "GROUP BY prediction ORDER BY SUM(count) DESC",
+        (user_id, *params)
+    )
+
+def user_count(db, source, user_id):
+    """Number of predictions logged for one user"""
+    return sum(count for _, count in user_class_counts(db, source, user_id))
+
+def recent_predictions(db, source=None):
+    """The last RECENT_SIZE (timestamp, prediction) pairs, newest first"""
+    if source is not None:
+        return db.query("SELECT timestamp, prediction FROM history_recent WHERE source=? ORDER BY seq DESC", (source,))
+    return db.query(f"SELECT timestamp, prediction FROM history_recent ORDER BY timestamp DESC LIMIT {RECENT_SIZE}")
@@ -0,0 +1,50 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from .codec import prediction_row
+from .schema import insert_statement
+
+class AsyncStore:
+    """Awaitable history access for asyncio front ends
+
+    Reads run on a dedicated thread so disk I/O never blocks the event loop;
+    writes go to the HistoryWriter and only leave the loop when the writer
+    would make the caller wait.
+    """
+
+    def __init__(self, db, writer):
+        self.db = db
+        self.writer = writer
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history-read')
+
+    async def run(self, func, *args, **kwargs):
+        """Run a blocking function on the store's thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def query(self, sql, params=()):
+        """Run a read query and return all rows"""
+        return await self.run(self.db.query, sql, params)
+
+    async def write(self, sql, params):
+        """Queue one row on the writer and return its write sequence number"""
+        return await self.write_group([(sql, [params])])
+
+    async def log(self, source, user_id, values, prediction, explanation, **columns):
+        """Queue one prediction for the shared predictions table"""
+        return await self.write_group([
+            (insert_statement('predictions'), [prediction_row(source, user_id, values, prediction, explanation, **columns)])
+        ])
+
+    async def write_group(self, statements):
+        """Queue (sql, rows) pairs that must land in the same transaction"""
+        if self.writer.may_block(sum(len(rows) for _, rows in statements)):
+            return await self.run(self.writer.write_group, statements)
+        return self.writer.write_group(statements)
+
+    def close(self):
+        """Stop the read thread, flush the writer and close the connections"""
+        self.executor.shutdown(wait=True)
+        self.writer.close()
+        self.db.close()
@@ -0,0 +1,36 @@
+import datetime
+import struct
+
+from inference.features import FEATURES
+
+# One explanation entry: feature index (uint8) and SHAP value (float32), 5 bytes
+ENTRY = struct.Struct('<Bf')
+FEATURE_INDEX = {feature: i for i, feature in enumerate(FEATURES)}
+
+def encode_explanation(explanation):
+    """Pack a {feature: value} explanation into a BLOB, or None when it is empty"""
+    if not explanation:
+        return None
+    return b''.join(ENTRY.pack(FEATURE_INDEX[feature], value) for feature, value in explanation.items())
+
+def decode_explanation(blob):
+    """Unpack a BLOB written by encode_explanation back into a {feature: value} dict"""
+    if not blob:
+        return {}
+    # Trim float32 noise so 0.304 doesn't come back as 0.30399999022483826
+    return {FEATURES[i]: float(f'{value:.7g}') for i, value in ENTRY.iter_unpack(blob)}
+
+def prediction_row(source, user_id, values, prediction, explanation, timestamp=None,
+                   request_id=None, batch_id=None, command=None):
+    """Build a predictions row, in PREDICTION_COLUMNS order"""
+    return (
+        source,
+        user_id,
+        timestamp or datetime.datetime.now().isoformat(),
+        request_id,
+        batch_id,
+        command,
+        *(float(v) for v in values),
+        int(prediction),
+        encode_explanation(explanation)
+    )
@@ -0,0 +1,81 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from .migrations import migrate
+
+# History database shared by the API server, web interface and Discord bot
+DB_PATH = os.getenv(
+    'HISTORY_DB_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'user_history.db')
+)
+
+# Connection tuning; WAL lets the three processes read while one of them writes
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-8000",  # 8 MB page cache
+    "PRAGMA temp_store=MEMORY",
+)
+
+class Database:
+    """Long-lived SQLite connections, one per thread, with the schema set up once at startup"""
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+        self.init_schema()
+
+    def connect(self):
+        """Open a new tuned connection in autocommit mode"""
+        # timeout makes concurrent writers wait for the lock instead of failing with 'database is locked'
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def connection(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.connect()
+            self.local.conn = conn
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Run statements in one write transaction, taking the write lock up front"""
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def execute(self, sql, params=()):
+        """Run a single statement in its own transaction"""
+        return self.connection().execute(sql, params)
+
+    def query(self, sql, params=()):
+        """Run a read query and return all rows"""
+        return self.connection().execute(sql, params).fetchall()
+
+    def init_schema(self):
+        """Create the history tables, migrating older schema versions in place"""
+        with self.transaction() as conn:
+            migrate(conn)
+
+    def close(self):
+        """Close every connection opened by this object"""
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections.clear()
+        self.local = threading.local()
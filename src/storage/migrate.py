@@ -0,0 +1,13 @@
+import logging
+import sys
+
+from .database import DB_PATH, Database
+
+# Upgrade a history database to the current schema; run from src/ as
+#   python -m storage.migrate [path/to/user_history.db]
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    db = Database(sys.argv[1] if len(sys.argv) > 1 else DB_PATH)
+    for source, count in db.query("SELECT source, COUNT(*) FROM predictions GROUP BY source"):
+        print(f"{source}: {count} live rows")
+    db.close()
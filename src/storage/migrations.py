@@ -0,0 +1,196 @@
+import ast
+import logging
+import os
+
+from inference.features import FEATURES
+
+from .codec import FEATURE_INDEX, encode_explanation
+from .partitions import (
+    HISTORY_ARCHIVE_DIR, archive_months, archive_path, partition_months, partition_name, read_archive, write_archive
+)
+from .schema import (
+    AGGREGATE_TABLES, PREDICTION_COLUMNS, RECENT_SIZE, SCHEMA, SCHEMA_VERSION, create_table, insert_statement
+)
+
+# Per-front-end history tables of schema versions 1-3 and the source each one becomes
+LEGACY_TABLE_COLUMNS = {
+    'api_history': ['user_id', 'timestamp', 'request_id', 'batch_id'] + FEATURES + ['prediction', 'explanation'],
+    'web_history': ['user_id', 'timestamp'] + FEATURES + ['prediction', 'explanation'],
+    'history': ['user_id', 'timestamp', 'command'] + FEATURES + ['prediction', 'explanation'],
+}
+LEGACY_SOURCES = {
+    'api_history': 'api',
+    'web_history': 'web',
+    'history': 'discord',
+}
+
+def table_exists(conn, table):
+    """Whether the database has a table of this name"""
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone() is not None
+
+def parse_values(text):
+    """Read feature values stored as str(list) or as space/comma separated numbers"""
+    if text is None:
+        return [None] * len(FEATURES)
+    try:
+        parsed = ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        parsed = None
+    if not isinstance(parsed, (list, tuple)):
+        parsed = str(text).replace(',', ' ').split()
+    try:
+        values = [float(v) for v in parsed]
+    except (TypeError, ValueError):
+        return [None] * len(FEATURES)
+    return values if len(values) == len(FEATURES) else [None] * len(FEATURES)
+
+def parse_prediction(text):
+    """Turn a stored class label back into an integer, keeping labels that aren't numbers"""
+    try:
+        return int(float(text))
+    except (TypeError, ValueError):
+        return text
+
+def parse_explanation(text):
+    """Read an explanation stored as str(dict) or as the bot's '- feature: value' lines"""
+    if not text:
+        return None
+    try:
+        parsed = ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        parsed = None
+    if not isinstance(parsed, dict):
+        parsed = {}
+        for line in str(text).splitlines():
+            feature, _, value = line.strip().lstrip('- ').partition(':')
+            try:
+                parsed[feature.strip()] = float(value)
+            except ValueError:
+                continue
+    return encode_explanation({f: float(v) for f, v in parsed.items() if f in FEATURE_INDEX})
+
+def migrate_v1(conn):
+    """Convert the stringified v0 history tables into typed columns"""
+    for table, columns in LEGACY_TABLE_COLUMNS.items():
+        existing = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+        if 'input' not in existing:
+            continue
+        legacy = f'{table}_v0'
+        conn.execute(f'ALTER TABLE {table} RENAME TO {legacy}')
+        conn.execute(create_table(table, columns=columns))
+        prefix = [column for column in columns[:columns.index(FEATURES[0])] if column in existing]
+        rows = conn.execute(f"SELECT {', '.join(prefix)}, input, prediction, explanation FROM {legacy}").fetchall()
+        conn.executemany(insert_statement(table, prefix + FEATURES + ['prediction', 'explanation']), [
+            (*row[:len(prefix)], *parse_values(row[-3]), parse_prediction(row[-2]), parse_explanation(row[-1]))
+            for row in rows
+        ])
+        conn.execute(f'DROP TABLE {legacy}')
+        logging.info(f'Migrated {len(rows)} rows of {table} to typed columns')
+
+def migrate_v2(conn):
+    """Create the aggregate tables and fill them from the rows already logged"""
+    for statement in AGGREGATE_TABLES:
+        conn.execute(statement)
+    for table in LEGACY_TABLE_COLUMNS:
+        if not table_exists(conn, table):
+            continue
+        conn.execute(
+            f"INSERT INTO history_class_counts SELECT '{table}', prediction, COUNT(*) FROM {table} GROUP BY prediction"
+        )
+        conn.execute(
+            f"INSERT INTO history_user_counts SELECT '{table}', user_id, prediction, COUNT(*) FROM {table} "
+            "GROUP BY user_id, prediction"
+        )
+        total = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        recent = conn.execute(f'SELECT timestamp, prediction FROM {table} ORDER BY id DESC LIMIT {RECENT_SIZE}').fetchall()
+        conn.executemany("INSERT INTO history_recent VALUES (?, ?, ?, ?, ?)", [
+            (table, (total - i) % RECENT_SIZE, total - i, timestamp, prediction)
+            for i, (timestamp, prediction) in enumerate(recent)
+        ])
+        logging.info(f'Built aggregates over {total} rows of {table}')
+
+def migrate_v3(conn):
+    """Add the batch_id column that ties batch rows to their batch_runs entry"""
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(api_history)')]
+    if columns and 'batch_id' not in columns:
+        conn.execute('ALTER TABLE api_history ADD COLUMN batch_id TEXT')
+
+def migrate_v4(conn, archive_dir=HISTORY_ARCHIVE_DIR):
+    """Merge the per-front-end tables, their partitions and archives into predictions with a source column"""
+    conn.execute(create_table('predictions'))
+    for table, columns in LEGACY_TABLE_COLUMNS.items():
+        source = LEGACY_SOURCES[table]
+        existing = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+        shared = [column for column in columns if column in existing]
+        targets = [(table, 'predictions')] + [
+            (partition_name(table, month), partition_name('predictions', month))
+            for month in partition_months(conn, table)
+        ]
+        for legacy, target in targets:
+            if not table_exists(conn, legacy):
+                continue
+            if target != 'predictions':
+                conn.execute(create_table('predictions', target))
+                conn.execute(f'CREATE INDEX IF NOT EXISTS {target}_user_time ON {target} (user_id, timestamp)')
+            conn.execute(
+                f"INSERT INTO {target} (source, {', '.join(shared)}) "
+                f"SELECT ?, {', '.join(shared)} FROM {legacy} ORDER BY timestamp, id",
+                (source,)
+            )
+            conn.execute(f'DROP TABLE {legacy}')
+
+        archive_columns = ['id'] + PREDICTION_COLUMNS
+        for month in archive_months(table, archive_dir):
+            path = archive_path(table, month, archive_dir)
+            # Legacy archives are already in (timestamp, id) order, so stream them across
+            rows = (dict(row, source=source) for row in read_archive(path, []))
+            write_archive(
+                archive_path('predictions', month, archive_dir), archive_columns,
+                ([row.get(column) for column in archive_columns] for row in rows)
+            )
+            os.remove(path)
+
+        # Aggregates were keyed by table name
+        for aggregate in ('history_class_counts', 'history_user_counts', 'history_recent'):
+            conn.execute(f'UPDATE {aggregate} SET source = ? WHERE source = ?', (source, table))
+        logging.info(f'Merged {table} into predictions as source {source!r}')
+
+def migrate_v5(conn, archive_dir=HISTORY_ARCHIVE_DIR):
+    """Rebuild predictions with AUTOINCREMENT, starting after every id already in partitions or archives"""
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='predictions'").fetchone()[0]
+    if 'AUTOINCREMENT' not in sql.upper():
+        columns = ', '.join(['id'] + PREDICTION_COLUMNS)
+        # The trigger and indexes follow the renamed table and are recreated from SCHEMA afterwards
+        conn.execute('ALTER TABLE predictions RENAME TO predictions_v4')
+        conn.execute(create_table('predictions'))
+        conn.execute(f'INSERT INTO predictions ({columns}) SELECT {columns} FROM predictions_v4')
+        conn.execute('DROP TABLE predictions_v4')
+
+    highest = [conn.execute('SELECT MAX(id) FROM predictions').fetchone()[0] or 0]
+    for month in partition_months(conn, 'predictions'):
+        highest.append(conn.execute(f"SELECT MAX(id) FROM {partition_name('predictions', month)}").fetchone()[0] or 0)
+    for month in archive_months('predictions', archive_dir):
+        highest.extend(row['id'] for row in read_archive(archive_path('predictions', month, archive_dir), []))
+    conn.execute("DELETE FROM sqlite_sequence WHERE name = 'predictions'")
+    conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('predictions', ?)", (max(highest),))
+    logging.info(f'Rebuilt predictions with ids starting after {max(highest)}')
+
+# Schema version -> step that brings the previous version up to it
+MIGRATIONS = {
+    1: migrate_v1,
+    2: migrate_v2,
+    3: migrate_v3,
+    4: migrate_v4,
+    5: migrate_v5,
+}
+
+def migrate(conn):
+    """Bring a history database up to SCHEMA_VERSION, inside the caller's transaction"""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for target in range(version + 1, SCHEMA_VERSION + 1):
+        MIGRATIONS[target](conn)
+    for statement in SCHEMA:
+        conn.execute(statement)
+    if version != SCHEMA_VERSION:
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        logging.info(f'History database upgraded from schema version {version} to {SCHEMA_VERSION}')
@@ -0,0 +1,260 @@
+import contextlib
+import csv
+import datetime
+import gzip
+import heapq
+import itertools
+import logging
+import os
+import sqlite3
+from collections import deque
+
+from .schema import COLUMN_TYPES, TABLE_COLUMNS, create_table
+
+# Whole months of history kept in SQLite before a partition is archived; 0 keeps everything
+HISTORY_RETENTION_MONTHS = int(os.getenv('HISTORY_RETENTION_MONTHS', '6'))
+# Where archived partitions are written as gzip-compressed CSV
+HISTORY_ARCHIVE_DIR = os.getenv(
+    'HISTORY_ARCHIVE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'history_archive')
+)
+
+# Rows fetched per query when reading partitions
+PAGE_SIZE = 1000
+
+# The live table only holds the current month; older rows move to {table}_pYYYYMM
+# partitions and partitions past the retention age to {archive_dir}/{table}_YYYYMM.csv.gz.
+# The aggregate tables keep counting every row ever inserted.
+
+def current_month():
+    """The current month as 'YYYY-MM', the prefix of this month's ISO timestamps"""
+    return datetime.datetime.now().strftime('%Y-%m')
+
+def shift_month(month, months):
+    """Add a number of months (possibly negative) to a 'YYYY-MM' month"""
+    year, mon = map(int, month.split('-'))
+    index = year * 12 + mon - 1 + months
+    return f'{index // 12:04d}-{index % 12 + 1:02d}'
+
+def partition_name(table, month):
+    """Table name of one month's partition"""
+    return f"{table}_p{month.replace('-', '')}"
+
+def archive_path(table, month, archive_dir=HISTORY_ARCHIVE_DIR):
+    """File name of one month's archived partition"""
+    return os.path.join(archive_dir, f"{table}_{month.replace('-', '')}.csv.gz")
+
+def partition_months(conn, table):
+    """Months that have a partition table, oldest first"""
+    prefix = f'{table}_p'
+    names = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+    suffixes = [name[len(prefix):] for name in names if name.startswith(prefix)]
+    return sorted(f'{s[:4]}-{s[4:]}' for s in suffixes if len(s) == 6 and s.isdigit())
+
+def archive_months(table, archive_dir=HISTORY_ARCHIVE_DIR):
+    """Months that have an archive file, oldest first"""
+    if not os.path.isdir(archive_dir):
+        return []
+    prefix, suffix = f'{table}_', '.csv.gz'
+    stems = [f[len(prefix):-len(suffix)] for f in os.listdir(archive_dir) if f.startswith(prefix) and f.endswith(suffix)]
+    return sorted(f'{s[:4]}-{s[4:]}' for s in stems if len(s) == 6 and s.isdigit())
+
+def split_months(conn, table, month):
+    """Move rows older than month out of the live table into their monthly partitions"""
+    columns = ', '.join(['id'] + TABLE_COLUMNS[table])
+    old_months = [row[0] for row in conn.execute(
+        f"SELECT DISTINCT substr(timestamp, 1, 7) FROM {table} WHERE timestamp < ?", (month,)
+    )]
+    for old in old_months:
+        name = partition_name(table, old)
+        conn.execute(create_table(table, name))
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name}_user_time ON {name} (user_id, timestamp)')
+        conn.execute(
+            f"INSERT INTO {name} ({columns}) SELECT {columns} FROM {table} WHERE substr(timestamp, 1, 7) = ?", (old,)
+        )
+        conn.execute(f"DELETE FROM {table} WHERE substr(timestamp, 1, 7) = ?", (old,))
+        logging.info(f'Moved {table} rows from {old} to {name}')
+
+def archive_field(value):
+    """Render one SQLite value as an archived CSV field"""
+    return '' if value is None else value.hex() if isinstance(value, bytes) else value
+
+def write_archive(path, columns, rows):
+    """Write rows sorted by (timestamp, id) to a gzip CSV archive, merged in order with any rows it already holds
+
+    Rows whose (timestamp, id) the archive already holds are written once.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    timestamp = columns.index('timestamp')
+
+    def order(row):
+        return (row[timestamp], int(row[0]))
+
+    # Written under a temporary name so readers never see a half-written archive
+    tmp_path = f'{path}.tmp'
+    with contextlib.ExitStack() as stack:
+        f = stack.enter_context(gzip.open(tmp_path, 'wt', newline=''))
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        new_rows = ([str(archive_field(v)) for v in row] for row in rows)
+        if os.path.exists(path):
+            # Late rows for an already archived month: keep the file sorted so it can be streamed
+            reader = csv.reader(stack.enter_context(gzip.open(path, 'rt', newline='')))
+            next(reader)
+            merged = heapq.merge(reader, new_rows, key=order)
+            # A roll that failed after replacing the archive left its rows in the partition
+            # too; they sort next to their archived copies, so keep one of each
+            new_rows = (next(group) for _, group in itertools.groupby(merged, key=order))
+        writer.writerows(new_rows)
+    os.replace(tmp_path, path)
+
+def archive_partition(conn, table, month, archive_dir=HISTORY_ARCHIVE_DIR):
+    """Write one partition to a gzip CSV file and drop it from the database"""
+    name = partition_name(table, month)
+    columns = ['id'] + TABLE_COLUMNS[table]
+    path = archive_path(table, month, archive_dir)
+    write_archive(path, columns, conn.execute(f"SELECT {', '.join(columns)} FROM {name} ORDER BY timestamp, id"))
+    conn.execute(f'DROP TABLE {name}')
+    logging.info(f'Archived {name} to {path}')
+
+def roll_partitions(db, retention_months=HISTORY_RETENTION_MONTHS, archive_dir=HISTORY_ARCHIVE_DIR):
+    """Partition every history table by month and archive partitions past the retention age"""
+    month = current_month()
+    with db.transaction() as conn:
+        for table in TABLE_COLUMNS:
+            split_months(conn, table, month)
+            if retention_months > 0:
+                cutoff = shift_month(month, -retention_months)
+                for old in partition_months(conn, table):
+                    if old < cutoff:
+                        archive_partition(conn, table, old, archive_dir)
+
+def parse_archived(column, value):
+    """Convert one archived CSV field back to its SQLite value"""
+    if value == '':
+        return None
+    kind = COLUMN_TYPES.get(column, 'INTEGER')
+    if kind == 'REAL':
+        return float(value)
+    if kind == 'INTEGER':
+        try:
+            return int(value)
+        except ValueError:
+            return value
+    if kind == 'BLOB':
+        return bytes.fromhex(value)
+    return value
+
+def read_archive(path, conditions):
+    """Read an archive file as column dicts, keeping rows that match every (column, test) condition"""
+    with gzip.open(path, 'rt', newline='') as f:
+        reader = csv.reader(f)
+        columns = next(reader)
+        for raw in reader:
+            row = {column: parse_archived(column, value) for column, value in zip(columns, raw)}
+            if all(test(row[column]) for column, test in conditions):
+                yield row
+
+def iter_history(db, table, start=None, end=None, user_id=None, prediction=None, source=None,
+                 newest_first=False, archive_dir=HISTORY_ARCHIVE_DIR):
+    """Yield rows of a history table as column dicts across the archive, the partitions and the live table
+
+    start and end are ISO timestamps (start inclusive, end exclusive); months
+    entirely outside them are skipped without being read. user_id, prediction
+    and source, when given, must match exactly. Archives are streamed in the
+    (timestamp, id) order they were written in, so newest_first only covers
+    the partitions and the live table; recent_history reads archives itself.
+    A partition archived while it is being read is finished from its archive
+    (or, newest first, raises sqlite3.OperationalError).
+    """
+    columns = ['id'] + TABLE_COLUMNS[table]
+    first_month = start[:7] if start else None
+    last_month = end[:7] if end else None
+
+    def wanted(month):
+        return (first_month is None or month >= first_month) and (last_month is None or month <= last_month)
+
+    conn = db.connection()
+    sources = [] if newest_first else [
+        ('archive', month) for month in archive_months(table, archive_dir) if wanted(month)
+    ]
+    sources += [('partition', month) for month in partition_months(conn, table) if wanted(month)]
+    sources.append(('live', None))
+    if newest_first:
+        sources.reverse()
+
+    where = []
+    params = []
+    conditions = []
+    if start:
+        where.append('timestamp >= ?')
+        params.append(start)
+        conditions.append(('timestamp', lambda v: v is not None and v >= start))
+    if end:
+        where.append('timestamp < ?')
+        params.append(end)
+        conditions.append(('timestamp', lambda v: v is not None and v < end))
+    if user_id is not None:
+        where.append('user_id = ?')
+        params.append(user_id)
+        conditions.append(('user_id', lambda v: v == user_id))
+    if prediction is not None:
+        where.append('prediction = ?')
+        params.append(prediction)
+        conditions.append(('prediction', lambda v: v == prediction))
+    if source is not None:
+        where.append('source = ?')
+        params.append(source)
+        conditions.append(('source', lambda v: v == source))
+
+    for kind, month in sources:
+        if kind == 'archive':
+            yield from read_archive(archive_path(table, month, archive_dir), conditions)
+            continue
+
+        # Keyset paging on (timestamp, id) keeps each query short and lets the
+        # caller consume rows from any thread
+        name = table if kind == 'live' else partition_name(table, month)
+        op, order = ('<', 'DESC') if newest_first else ('>', 'ASC')
+        key = None
+        while True:
+            page_where = list(where)
+            page_params = list(params)
+            if key is not None:
+                page_where.append(f'(timestamp, id) {op} (?, ?)')
+                page_params.extend(key)
+            sql = f"SELECT {', '.join(columns)} FROM {name}"
+            if page_where:
+                sql += ' WHERE ' + ' AND '.join(page_where)
+            sql += f' ORDER BY timestamp {order}, id {order} LIMIT {PAGE_SIZE}'
+            try:
+                page = db.query(sql, page_params)
+            except sqlite3.OperationalError:
+                # The partition may have been archived by another process meanwhile;
+                # carry on from its archive rather than leave the month out
+                if kind != 'partition' or newest_first or month not in archive_months(table, archive_dir):
+                    raise
+                archived = read_archive(archive_path(table, month, archive_dir), conditions)
+                if key is not None:
+                    archived = (row for row in archived if (row['timestamp'], row['id']) > key)
+                yield from archived
+                break
+            for row in page:
+                yield dict(zip(columns, row))
+            if len(page) < PAGE_SIZE:
+                break
+            key = (page[-1][columns.index('timestamp')], page[-1][0])
+
+def recent_history(db, table, user_id, limit, source=None, archive_dir=HISTORY_ARCHIVE_DIR):
+    """The user's last limit rows, newest first, wherever they are stored"""
+    rows = list(itertools.islice(iter_history(db, table, user_id=user_id, source=source, newest_first=True), limit))
+    conditions = [('user_id', lambda v: v == user_id)]
+    if source is not None:
+        conditions.append(('source', lambda v: v == source))
+    for month in reversed(archive_months(table, archive_dir)):
+        if len(rows) >= limit:
+            break
+        # Archives are oldest first, so keep only the newest matching rows of the month
+        newest = deque(read_archive(archive_path(table, month, archive_dir), conditions), maxlen=limit - len(rows))
+        rows.extend(reversed(newest))
+    return rows
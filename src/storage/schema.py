@@ -0,0 +1,128 @@
+from inference.features import FEATURES
+
+# Bumped whenever the tables below change; stored in PRAGMA user_version
+SCHEMA_VERSION = 5
+
+# Front ends that log predictions, stored in the source column
+SOURCES = ('api', 'web', 'discord', 'mobile')
+
+# Columns of the history table shared by every front end, in insert order.
+# request_id and batch_id are set by the API, command by the Discord bot;
+# every feature gets its own REAL column, prediction is the class label and
+# explanation is a codec-encoded BLOB.
+PREDICTION_COLUMNS = (
+    ['source', 'user_id', 'timestamp', 'request_id', 'batch_id', 'command'] + FEATURES + ['prediction', 'explanation']
+)
+TABLE_COLUMNS = {
+    'predictions': PREDICTION_COLUMNS,
+}
+
+COLUMN_TYPES = dict(
+    {feature: 'REAL' for feature in FEATURES},
+    source='TEXT',
+    user_id='TEXT',
+    timestamp='TEXT',
+    request_id='TEXT',
+    batch_id='TEXT',
+    command='TEXT',
+    prediction='INTEGER',
+    explanation='BLOB',
+)
+
+def create_table(table, name=None, columns=None):
+    """CREATE TABLE statement for a history table, or for a copy of its layout called name"""
+    columns = ',\n    '.join(f'{column} {COLUMN_TYPES[column]}' for column in columns or TABLE_COLUMNS[table])
+    # The live table empties whenever its rows move to a partition, so it must
+    # never hand out an id again; copies keep the ids of the rows moved into them
+    key = 'INTEGER PRIMARY KEY' if name else 'INTEGER PRIMARY KEY AUTOINCREMENT'
+    return f'CREATE TABLE IF NOT EXISTS {name or table} (\n    id {key},\n    {columns}\n)'
+
+def insert_statement(table, columns=None):
+    """INSERT statement taking one parameter per column of a history table"""
+    columns = columns or INSERT_COLUMNS[table]
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+# One row per /batch-predict call; its rows share batch_id in predictions
+BATCH_RUNS_COLUMNS = [
+    'batch_id', 'user_id', 'timestamp', 'explain_mode', 'total_rows', 'successful', 'failed', 'processing_time'
+]
+BATCH_RUNS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS batch_runs (
+        batch_id TEXT PRIMARY KEY,
+        user_id TEXT,
+        timestamp TEXT,
+        explain_mode TEXT,
+        total_rows INTEGER,
+        successful INTEGER,
+        failed INTEGER,
+        processing_time REAL
+    )
+'''
+
+INSERT_COLUMNS = dict(TABLE_COLUMNS, batch_runs=BATCH_RUNS_COLUMNS)
+
+# Number of rows kept in the recent-predictions ring buffer
+RECENT_SIZE = 10
+
+# Running aggregates per source over every row ever inserted into the history
+# table, kept current by the trigger below
+AGGREGATE_TABLES = (
+    '''
+    CREATE TABLE IF NOT EXISTS history_class_counts (
+        source TEXT,
+        prediction INTEGER,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (source, prediction)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS history_user_counts (
+        source TEXT,
+        user_id TEXT,
+        prediction INTEGER,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (source, user_id, prediction)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS history_recent (
+        source TEXT,
+        slot INTEGER,
+        seq INTEGER NOT NULL,
+        timestamp TEXT,
+        prediction INTEGER,
+        PRIMARY KEY (source, slot)
+    )
+    ''',
+)
+
+AGGREGATE_TRIGGER = f'''
+    CREATE TRIGGER IF NOT EXISTS predictions_aggregates AFTER INSERT ON predictions
+    BEGIN
+        INSERT INTO history_class_counts VALUES (NEW.source, NEW.prediction, 1)
+            ON CONFLICT (source, prediction) DO UPDATE SET count = count + 1;
+        INSERT INTO history_user_counts VALUES (NEW.source, NEW.user_id, NEW.prediction, 1)
+            ON CONFLICT (source, user_id, prediction) DO UPDATE SET count = count + 1;
+        INSERT OR REPLACE INTO history_recent
+            SELECT NEW.source, total % {RECENT_SIZE}, total, NEW.timestamp, NEW.prediction
+            FROM (SELECT SUM(count) AS total FROM history_class_counts WHERE source = NEW.source);
+    END
+'''
+
+INDEXES = (
+    'CREATE INDEX IF NOT EXISTS predictions_user_time ON predictions (user_id, timestamp)',
+    'CREATE INDEX IF NOT EXISTS predictions_source_time ON predictions (source, timestamp)',
+    'CREATE INDEX IF NOT EXISTS predictions_prediction ON predictions (prediction)',
+    'CREATE INDEX IF NOT EXISTS predictions_batch ON predictions (batch_id)',
+    'CREATE INDEX IF NOT EXISTS predictions_request ON predictions (request_id)',
+    'CREATE INDEX IF NOT EXISTS batch_runs_user_time ON batch_runs (user_id, timestamp)',
+)
+
+# Prediction history table, its indexes and the aggregates maintained on insert
+SCHEMA = (
+    create_table('predictions'),
+    BATCH_RUNS_TABLE,
+    *AGGREGATE_TABLES,
+    AGGREGATE_TRIGGER,
+    *INDEXES,
+)
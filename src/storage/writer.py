@@ -0,0 +1,248 @@
+import atexit
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+
+from .codec import prediction_row
+from .partitions import current_month, roll_partitions
+from .schema import insert_statement
+
+# Write-behind configuration
+HISTORY_FLUSH_INTERVAL = float(os.getenv('HISTORY_FLUSH_INTERVAL', '0.5'))  # seconds
+HISTORY_BATCH_SIZE = int(os.getenv('HISTORY_BATCH_SIZE', '500'))  # rows per transaction
+HISTORY_QUEUE_SIZE = int(os.getenv('HISTORY_QUEUE_SIZE', '10000'))  # pending rows held in memory
+# 'async': return at once, 'full': also fsync every flush, 'sync': wait until the row is committed
+# (sync flushes as soon as rows arrive, grouping concurrent writers into one commit)
+HISTORY_DURABILITY = os.getenv('HISTORY_DURABILITY', 'async')
+# What to do when the queue is full: 'block' the caller or 'drop' the rows
+HISTORY_OVERFLOW = os.getenv('HISTORY_OVERFLOW', 'block')
+
+DURABILITY_MODES = ('async', 'full', 'sync')
+OVERFLOW_POLICIES = ('block', 'drop')
+
+# Queue item that wakes the writer thread up to flush and exit
+_STOP = object()
+
+class HistoryWriteError(Exception):
+    """Raised to a sync-durability writer whose rows could not be committed"""
+
+class HistoryWriter:
+    """Collects history rows on a bounded queue and inserts them from a background thread
+
+    Rows are grouped by statement and written with executemany, one transaction
+    per flush. A flush happens every flush_interval seconds or as soon as
+    batch_size rows are waiting, and close() (also run at exit) writes whatever
+    is left. At most queue_size rows wait at once; a single larger write is
+    still let in when nothing else is waiting. The writer thread also moves
+    history into monthly partitions and archives old ones whenever the month
+    changes.
+    """
+
+    def __init__(self, db, flush_interval=HISTORY_FLUSH_INTERVAL, batch_size=HISTORY_BATCH_SIZE,
+                 queue_size=HISTORY_QUEUE_SIZE, durability=HISTORY_DURABILITY, overflow=HISTORY_OVERFLOW):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability {durability!r}, expected one of {DURABILITY_MODES}")
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow!r}, expected one of {OVERFLOW_POLICIES}")
+        self.db = db
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.durability = durability
+        self.overflow = overflow
+        self.queue_size = queue_size
+        self.queue = queue.Queue()
+        # Guards pending and closed; writers blocked on a full queue wait on it
+        self.pending_lock = threading.Condition()
+        self.pending = 0  # rows queued and not yet flushed
+        self.closed = False
+        self.month = None
+        # Every queued write gets the next sequence number; committed is the
+        # highest one the writer has finished with
+        self.sequence = itertools.count(1)
+        self.committed = 0
+        # Errors of failed sync writes, by sequence number, until their caller picks them up
+        self.failures = {}
+
+        # Metrics
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+
+        self.thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write(self, sql, params):
+        """Queue one row for insertion and return its write sequence number"""
+        return self.write_many(sql, [params])
+
+    def log(self, source, user_id, values, prediction, explanation, **columns):
+        """Queue one prediction for the shared predictions table; columns sets request_id, batch_id or command"""
+        return self.write(
+            insert_statement('predictions'),
+            prediction_row(source, user_id, values, prediction, explanation, **columns)
+        )
+
+    def write_many(self, sql, rows):
+        """Queue several rows for the same statement, committed together"""
+        return self.write_group([(sql, rows)])
+
+    def write_group(self, statements):
+        """Queue (sql, rows) pairs that must land in the same transaction
+
+        Returns the write's sequence number; once committed reaches it the rows
+        are visible to readers. With sync durability a failed commit raises
+        HistoryWriteError.
+        """
+        statements = [(sql, rows) for sql, rows in statements if rows]
+        if not statements:
+            return self.committed
+        count = sum(len(rows) for _, rows in statements)
+        done = threading.Event() if self.durability == 'sync' else None
+        seq = next(self.sequence)
+        item = (statements, count, done, seq)
+        with self.pending_lock:
+            while not self.closed and self._full(count):
+                if self.overflow == 'drop':
+                    self.dropped += count
+                    return seq
+                self.pending_lock.wait()
+            # Checked under the lock close() takes, so nothing is queued behind the stop marker
+            late = self.closed
+            if not late:
+                self.pending += count
+                self.queue.put(item)
+        if late:
+            # Late writes after shutdown go straight to the database
+            error = self._flush([item])
+        elif done is not None:
+            done.wait()
+            with self.pending_lock:
+                error = self.failures.pop(seq, None)
+        else:
+            return seq
+        if error is not None and done is not None:
+            raise HistoryWriteError(f'History write {seq} was not committed: {error}') from error
+        return seq
+
+    def _full(self, count):
+        """Whether count more rows would overflow the queue; a write is always let into an empty one"""
+        return self.pending and self.pending + count > self.queue_size
+
+    def may_block(self, count=1):
+        """Whether writing count rows right now would wait on the database rather than return at once"""
+        return self.durability == 'sync' or self.closed or (self.overflow == 'block' and self._full(count))
+
+    def _run(self):
+        """Writer thread: gather queued rows and flush them in batches"""
+        if self.durability == 'full':
+            self.db.connection().execute("PRAGMA synchronous=FULL")
+        self._maintain()
+        stopping = False
+        while not stopping:
+            # Sleep until the first row arrives, then gather more until the interval or batch size is reached
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            items = [item]
+            rows = item[1]
+            # In sync mode callers are waiting, so commit whatever is already queued right away
+            deadline = time.monotonic() + (0 if self.durability == 'sync' else self.flush_interval)
+            while rows < self.batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                items.append(item)
+                rows += item[1]
+            self._flush(items)
+            self._release(items)
+            self._maintain()
+        # Drain anything queued behind the stop marker
+        items = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                items.append(item)
+        if items:
+            self._flush(items)
+            self._release(items)
+
+    def _flush(self, items):
+        """Insert a group of queued rows in one transaction; returns the error if it failed"""
+        grouped = {}
+        for statements, _, _, _ in items:
+            for sql, rows in statements:
+                grouped.setdefault(sql, []).extend(rows)
+        count = sum(item_count for _, item_count, _, _ in items)
+        error = None
+        try:
+            with self.db.transaction() as conn:
+                for sql, rows in grouped.items():
+                    conn.executemany(sql, rows)
+            self.written += count
+        except Exception as e:
+            error = e
+            self.failed += count
+            logging.error(f'History flush of {count} rows failed: {e}')
+        self.flushes += 1
+        self.committed = max(self.committed, max(seq for _, _, _, seq in items))
+        for _, _, done, seq in items:
+            if done is not None:
+                if error is not None:
+                    with self.pending_lock:
+                        self.failures[seq] = error
+                done.set()
+        return error
+
+    def _release(self, items):
+        """Free the queue room of flushed items and wake writers waiting for it"""
+        with self.pending_lock:
+            self.pending -= sum(item[1] for item in items)
+            self.pending_lock.notify_all()
+
+    def _maintain(self):
+        """Partition and archive history when the month changes, starting with the first run"""
+        month = current_month()
+        if month == self.month:
+            return
+        try:
+            roll_partitions(self.db)
+        except Exception as e:
+            logging.error(f'History partitioning failed: {e}')
+        self.month = month
+
+    def stats(self):
+        """Return queue depth and write counters"""
+        return {
+            'durability': self.durability,
+            'overflow': self.overflow,
+            'queued': self.pending,
+            'max_queued': self.queue_size,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'flushes': self.flushes
+        }
+
+    def close(self):
+        """Flush every queued row and stop the writer thread"""
+        with self.pending_lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.queue.put(_STOP)
+            # Writers waiting for room write inline instead
+            self.pending_lock.notify_all()
+        self.thread.join()
@@ -2,6 +2,8 @@ import pandas as pd
 from sklearn.ensemble import RandomForestClassifier
 import joblib
 
+from inference import CompiledForest
+
 # Load dataset
 DATA_PATH = 'Multiclass_Diabetes_Dataset.csv'
 df = pd.read_csv(DATA_PATH)
@@ -16,4 +18,8 @@ model.fit(X, y)
 
 # Export model
 joblib.dump(model, 'src/diabetes_model.pkl')
-print('Model trained and saved as src/diabetes_model.pkl') 
\ No newline at end of file
+print('Model trained and saved as src/diabetes_model.pkl') 
+
+# Export the forest as flat node arrays for the compiled evaluator
+CompiledForest.from_sklearn(model).save('src/diabetes_forest.npz')
+print('Compiled forest exported as src/diabetes_forest.npz')
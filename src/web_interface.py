@@ -1,93 +1,35 @@
-from flask import Flask, render_template, render_template_string, request, jsonify, session
-import pandas as pd
-import joblib
-import numpy as np
-import shap
-import sqlite3
-import datetime
+from flask import Flask, render_template, render_template_string, request, jsonify, send_file, session
+import io
+import itertools
 import os
+import tempfile
 from werkzeug.security import generate_password_hash, check_password_hash
 
+from inference import (
+    EXPLAIN_MODES, FEATURES, FEATURE_RANGES, MODEL_PATH, SCORED_COLUMNS, InferenceEngine, PredictionCache,
+    read_csv_chunks, scored_csv, validate_input
+)
+from storage import DB_PATH, Database, HistoryWriter
+from storage import aggregates
+
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'your-secret-key-here')
 
-# Load the trained model
-MODEL_PATH = os.path.join(os.path.dirname(__file__), 'diabetes_model.pkl')
-model = joblib.load(MODEL_PATH)
-
-# Define features
-FEATURES = ['Gender', 'AGE', 'Urea', 'Cr', 'HbA1c', 'Chol', 'TG', 'HDL', 'LDL', 'VLDL', 'BMI']
-
-# Feature validation ranges
-FEATURE_RANGES = {
-    'Gender': (0, 1),
-    'AGE': (18, 100),
-    'Urea': (1.0, 50.0),
-    'Cr': (5, 1000),
-    'HbA1c': (3.0, 15.0),
-    'Chol': (1.0, 10.0),
-    'TG': (0.1, 50.0),
-    'HDL': (0.1, 5.0),
-    'LDL': (0.1, 10.0),
-    'VLDL': (0.1, 50.0),
-    'BMI': (15.0, 50.0)
-}
+# Load the trained model and its explainer through the shared inference engine,
+# with repeated inputs served from the prediction cache
+engine = InferenceEngine(MODEL_PATH, cache=PredictionCache())
 
-# SQLite setup
-DB_PATH = os.path.join(os.path.dirname(__file__), 'user_history.db')
+# Explanation mode for the interactive form; set to 'fast' to trade a measured error for latency
+EXPLAIN_MODE = os.getenv('EXPLAIN_MODE', 'exact')
 
-def validate_input(values):
-    """Validate input values against expected ranges"""
-    errors = []
-    for i, (feature, value) in enumerate(zip(FEATURES, values)):
-        min_val, max_val = FEATURE_RANGES[feature]
-        if value < min_val or value > max_val:
-            errors.append(f"{feature}: {value} (should be between {min_val} and {max_val})")
-    return errors
-
-def get_prediction_with_explanation(values):
-    """Get prediction and SHAP explanation"""
-    values_df = pd.DataFrame([values], columns=FEATURES)
-    pred = model.predict(values_df)[0]
-    
-    # SHAP explanation
-    try:
-        explainer = shap.TreeExplainer(model)
-        shap_values = explainer.shap_values(values_df)
-        if isinstance(shap_values, list):
-            class_idx = int(pred)
-            shap_val = shap_values[class_idx][0]
-        else:
-            shap_val = shap_values[0]
-        
-        # Get top 5 features
-        top_idx = np.argsort(np.abs(shap_val))[::-1][:5]
-        explanation = {FEATURES[i]: float(shap_val[i]) for i in top_idx}
-    except:
-        explanation = {}
-    
-    return pred, explanation
+# SQLite setup: persistent per-thread connections, schema created once here
+db = Database(DB_PATH)
+# History rows are queued and inserted in bulk by a background thread
+history = HistoryWriter(db)
 
 def log_prediction(user_id, values, prediction, explanation):
-    """Log prediction to database"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS web_history (
-            user_id TEXT,
-            timestamp TEXT,
-            input TEXT,
-            prediction TEXT,
-            explanation TEXT
-        )
-    ''')
-    
-    c.execute(
-        "INSERT INTO web_history (user_id, timestamp, input, prediction, explanation) VALUES (?, ?, ?, ?, ?)",
-        (user_id, datetime.datetime.now().isoformat(), str(values), str(prediction), str(explanation))
-    )
-    conn.commit()
-    conn.close()
+    """Queue a prediction for the history database"""
+    history.log('web', user_id, values, prediction, explanation)
 
 @app.route('/')
 def index():
@@ -482,7 +424,10 @@ def predict():
             return jsonify({'error': 'Validation failed', 'details': errors}), 400
         
         # Get prediction and explanation
-        prediction, explanation = get_prediction_with_explanation(values)
+        explain_mode = request.args.get('explain_mode', EXPLAIN_MODE)
+        if explain_mode not in EXPLAIN_MODES:
+            return jsonify({'error': f'explain_mode must be one of {list(EXPLAIN_MODES)}'}), 400
+        prediction, explanation = engine.predict_with_explanation(values, mode=explain_mode)
         
         # Log prediction
         user_id = session.get('user_id', 'anonymous')
@@ -501,59 +446,120 @@ def predict():
 def batch_predict():
     try:
         data = request.get_json()
-        results = []
+        results = [None] * len(data['data'])
+        valid_rows = []
+        valid_positions = []
         
+        # Validate every row and collect the valid ones into one matrix
         for i, row in enumerate(data['data']):
             try:
                 values = [float(row[feature]) for feature in FEATURES]
                 errors = validate_input(values)
                 
                 if errors:
-                    results.append({
+                    results[i] = {
                         'row': i + 1,
                         'error': f'Validation failed: {errors[:2]}'
-                    })
+                    }
                 else:
-                    prediction, explanation = get_prediction_with_explanation(values)
-                    results.append({
+                    valid_rows.append(values)
+                    valid_positions.append(i)
+            except Exception as e:
+                results[i] = {
+                    'row': i + 1,
+                    'error': str(e)
+                }
+        
+        # One predict and one SHAP call for the whole batch
+        if valid_rows:
+            try:
+                predictions, explanations = engine.predict_batch_with_explanations(valid_rows)
+                for i, prediction, explanation in zip(valid_positions, predictions, explanations):
+                    results[i] = {
                         'row': i + 1,
                         'prediction': str(prediction),
                         'explanation': explanation
-                    })
+                    }
             except Exception as e:
-                results.append({
-                    'row': i + 1,
-                    'error': str(e)
-                })
+                for i in valid_positions:
+                    results[i] = {
+                        'row': i + 1,
+                        'error': str(e)
+                    }
         
         return jsonify({'results': results})
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def score_csv_chunk(X, errors):
+    """Predict the valid rows of a parsed CSV chunk; failed rows get None and an entry in errors"""
+    predictions = [None] * len(X)
+    valid = [offset for offset in range(len(X)) if offset not in errors]
+    if valid:
+        try:
+            for offset, prediction in zip(valid, engine.predict_batch(X[valid])):
+                predictions[offset] = str(prediction)
+        except Exception as e:
+            for offset in valid:
+                errors[offset] = str(e)
+    return predictions
+
+@app.route('/batch_predict/csv', methods=['POST'])
+def batch_predict_csv():
+    """Score an uploaded CSV chunk by chunk, as JSON results or (download=1) a scored CSV"""
+    upload = request.files.get('file')
+    if upload is None:
+        return jsonify({'error': 'Upload a CSV file in the "file" field'}), 400
+    # Uploads past a few hundred KB are spooled to disk, so only one chunk is in memory at a time
+    chunks = read_csv_chunks(io.TextIOWrapper(upload.stream, encoding='utf-8-sig'))
+    try:
+        first = next(chunks, None)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+    scored = [] if first is None else [first]
+    
+    if request.args.get('download') in ('1', 'true', 'yes'):
+        # Flask closes the upload when the view returns, so score into a temporary file and send that
+        scored_file = tempfile.TemporaryFile(mode='w+b')
+        out = io.TextIOWrapper(scored_file, encoding='utf-8', newline='')
+        out.write(','.join(SCORED_COLUMNS) + '\n')
+        for _, X, errors in itertools.chain(scored, chunks):
+            out.write(scored_csv(X, score_csv_chunk(X, errors), errors))
+        # Flush and let go of the file without closing it
+        out.detach()
+        scored_file.seek(0)
+        return send_file(scored_file, mimetype='text/csv', as_attachment=True, download_name='scored.csv')
+    
+    try:
+        results = []
+        for first_row, X, errors in itertools.chain(scored, chunks):
+            for offset, prediction in enumerate(score_csv_chunk(X, errors)):
+                if prediction is None:
+                    results.append({'row': first_row + offset, 'error': errors[offset]})
+                else:
+                    results.append({'row': first_row + offset, 'prediction': prediction})
+        return jsonify({'results': results})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/stats')
 def stats():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
     # Get total predictions
-    c.execute("SELECT COUNT(*) FROM web_history")
-    total_predictions = c.fetchone()[0]
+    total_predictions = aggregates.total_count(db, 'web')
     
     # Get predictions by class
-    c.execute("SELECT prediction, COUNT(*) FROM web_history GROUP BY prediction")
-    class_counts = dict(c.fetchall())
+    class_counts = aggregates.class_counts(db, 'web')
     
     # Get recent predictions
-    c.execute("SELECT timestamp, prediction FROM web_history ORDER BY timestamp DESC LIMIT 10")
-    recent = c.fetchall()
-    
-    conn.close()
+    recent = aggregates.recent_predictions(db, 'web')
     
     return jsonify({
         'total_predictions': total_predictions,
         'class_distribution': class_counts,
-        'recent_predictions': recent
+        'recent_predictions': recent,
+        'prediction_cache': engine.cache.stats(),
+        'history_writer': history.stats()
     })
 
 @app.route('/api/docs')
@@ -255,39 +255,31 @@ async function handleBatchPrediction() {
     batchPredictBtn.disabled = true;
     
     try {
-        // Read CSV file
-        const text = await file.text();
-        const lines = text.split('\n');
-        const headers = lines[0].split(',');
-        const data = [];
+        // Upload the file as is; the server parses it in chunks
+        const formData = new FormData();
+        formData.append('file', file);
+        const download = document.getElementById('downloadScored').checked;
         
-        // Parse CSV data
-        for (let i = 1; i < lines.length; i++) {
-            if (lines[i].trim()) {
-                const values = lines[i].split(',');
-                const row = {};
-                headers.forEach((header, index) => {
-                    row[header.trim()] = parseFloat(values[index]);
-                });
-                data.push(row);
-            }
-        }
-        
-        // Send batch prediction request
-        const response = await fetch('/batch_predict', {
+        const response = await fetch('/batch_predict/csv' + (download ? '?download=1' : ''), {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({ data: data })
+            body: formData
         });
         
-        const result = await response.json();
-        
-        if (response.ok) {
-            displayBatchResults(result.results);
-        } else {
+        if (!response.ok) {
+            const result = await response.json();
             displayError(result.error || 'Batch prediction failed');
+        } else if (download) {
+            // Save the scored CSV returned by the server
+            const blob = await response.blob();
+            const link = document.createElement('a');
+            link.href = URL.createObjectURL(blob);
+            link.download = 'scored_' + file.name;
+            link.click();
+            URL.revokeObjectURL(link.href);
+            loadStatistics();
+        } else {
+            const result = await response.json();
+            displayBatchResults(result.results);
         }
     } catch (error) {
         displayError('Error processing file: ' + error.message);